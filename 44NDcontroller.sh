@@ -1,5 +1,5 @@
 rm output/*
 rm input/*.ext
-cp input/data/$2 input/file.ext
 
-python2 $1 4 4 mapreduce final 0
\ No newline at end of file
+# The data file, directory or glob pattern is read in place
+python3 $1 4 4 mapreduce final 0 - "input/data/$2"
\ No newline at end of file
@@ -0,0 +1,368 @@
+# Benchmark suite - runs a job over a synthetic Zipf-distributed corpus for a grid of mapper and reducer counts
+# Reports the wall time of every phase, the throughput and the peak memory of every run as JSON, and compares them against a stored baseline
+# Every run is a fresh subprocess running this same file in worker mode, so that its peak memory is its own
+from __future__ import print_function
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import fileNameRetriever
+
+
+# Prefix of the line a benchmark worker prints its measurements on
+BENCH_RESULT = "BENCH_RESULT"
+
+# Phases of a run, in order
+PHASES = ['split', 'map', 'reduce', 'join']
+
+# Number of words written at a time while generating a corpus, and of words on every line
+WORD_BATCH = 1 << 14
+WORDS_PER_LINE = 12
+
+# Letters the words of a synthetic corpus are made of
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+# Timings shorter than this (in seconds) in the baseline are too noisy to be compared
+MIN_COMPARED_TIME = 0.05
+
+
+def parse_size(size):
+
+    """
+    Function to read a size in bytes, with an optional K, M or G suffix
+
+    Input -
+    size: the size, for example 64M
+
+    Output -
+    The number of bytes
+    """
+
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if size[-1:].upper() in units:
+        return int(float(size[:-1]) * units[size[-1:].upper()])
+
+    return int(size)
+
+
+def word_for_rank(rank):
+
+    """
+    Function to name the word of a given rank - the most frequent words are the shortest, as in natural text
+
+    Input -
+    rank: rank of the word, from 0
+
+    Output -
+    The word, as bytes
+    """
+
+    letters = []
+    rank += 1
+    while rank > 0:
+        rank, letter = divmod(rank - 1, len(LETTERS))
+        letters.append(LETTERS[letter])
+
+    return "".join(reversed(letters)).encode("ascii")
+
+
+def generate_corpus(filename, size, vocabulary, exponent, seed):
+
+    """
+    Function to write a corpus of words drawn from a Zipf distribution - the word of rank k turns up in proportion to 1 / k ** exponent
+    The corpus only depends on its parameters, it is the same on every run and interpreter
+
+    Inputs -
+    filename: path of the corpus to write
+    size: number of bytes to write, the last line may take it a little over
+    vocabulary: number of distinct words
+    exponent: exponent of the distribution, 1.0 being that of natural text
+    seed: seed of the random number generator
+    """
+
+    words = [word_for_rank(rank) for rank in range(vocabulary)]
+
+    # Cumulative weights, a word is drawn by bisecting them
+    cumulative_weights = []
+    total = 0.0
+    for rank in range(vocabulary):
+        total += 1.0 / (rank + 1) ** exponent
+        cumulative_weights.append(total)
+
+    generator = random.Random(seed)
+    draw = generator.random
+    last = vocabulary - 1
+
+    # Write the corpus aside and rename it into place, so that an interrupted run never leaves a partial corpus behind
+    attempt_name = fileNameRetriever.get_attempt_filename(filename)
+    corpus = open(attempt_name, "wb")
+    written = 0
+
+    while written < size:
+        batch = [words[bisect.bisect_right(cumulative_weights, draw() * total, 0, last)] for i in range(WORD_BATCH)]
+        lines = b"\n".join(b" ".join(batch[start:start + WORDS_PER_LINE]) for start in range(0, WORD_BATCH, WORDS_PER_LINE)) + b"\n"
+        corpus.write(lines)
+        written += len(lines)
+
+    corpus.close()
+    os.rename(attempt_name, filename)
+
+
+def get_corpus(size, vocabulary, exponent, seed):
+
+    """
+    Function to find the corpus generated with the given parameters, generating it on the first run only
+
+    Inputs -
+    size, vocabulary, exponent, seed: parameters of the corpus, as for generate_corpus()
+
+    Output -
+    Path of the corpus
+    """
+
+    filename = fileNameRetriever.get_bench_corpus_filename(size, vocabulary, exponent, seed)
+
+    if not(os.path.exists(filename)):
+        if not(os.path.isdir(os.path.dirname(filename))):
+            os.makedirs(os.path.dirname(filename))
+
+        print("Generating " + filename, file=sys.stderr)
+        generate_corpus(filename, size, vocabulary, exponent, seed)
+
+    return filename
+
+
+def peak_rss():
+
+    """
+    Function to read the peak resident memory of the current process and of the worker processes it waited for
+
+    Output -
+    The peak resident memory, in MB
+    """
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    # Linux counts in KB, macOS in bytes
+    if sys.platform == 'darwin':
+        return peak / float(1 << 20)
+
+    return peak / float(1 << 10)
+
+
+def clear_outputs():
+
+    """
+    Function to clear out the outputs and splits of the previous run, so that the manifest never skips any task
+    """
+
+    for directory in ['output', 'input']:
+        for name in os.listdir(directory):
+            if name.endswith('.ext') or (directory == 'output' and os.path.isfile(os.path.join(directory, name))):
+                os.unlink(os.path.join(directory, name))
+
+
+def run_worker(taskfile, corpus, num_of_mappers, num_of_reducers):
+
+    """
+    Function run in every benchmark subprocess - runs the whole job once and prints the wall time of every phase and the peak memory
+
+    Inputs -
+    taskfile: path of the task file
+    corpus: path of the corpus
+    num_of_mappers, num_of_reducers: number of map and reduce tasks
+    """
+
+    # Imported here, so that the job code is only loaded in the subprocesses
+    from coordinator import load_job
+
+    clear_outputs()
+    timings = {}
+
+    # The job splits its input as it is set up
+    start = time.time()
+    job = load_job(taskfile)(corpus, 'output', num_of_mappers, num_of_reducers)
+    timings['split'] = time.time() - start
+
+    start = time.time()
+    job.mapper_mode()
+    timings['map'] = time.time() - start
+
+    start = time.time()
+    job.reducer_mode(thread_id=list(range(num_of_reducers)))
+    timings['reduce'] = time.time() - start
+
+    start = time.time()
+    job.join_outputs(top_k=25)
+    timings['join'] = time.time() - start
+
+    sys.stdout.write(BENCH_RESULT + " " + json.dumps({"phases": timings, "peak_rss": peak_rss()}) + "\n")
+    sys.stdout.flush()
+
+
+def run_configuration(taskfile, corpus, num_of_mappers, num_of_reducers, repeat):
+
+    """
+    Function to benchmark a single point of the grid, keeping the fastest of several runs
+
+    Inputs -
+    taskfile: path of the task file
+    corpus: path of the corpus
+    num_of_mappers, num_of_reducers: number of map and reduce tasks
+    repeat: number of runs
+
+    Output -
+    Dictionary holding the measurements of the fastest run
+    """
+
+    best = None
+    for attempt in range(repeat):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'worker', taskfile, corpus, str(num_of_mappers), str(num_of_reducers)])
+
+        # The job prints its own progress, only the line holding the measurements counts
+        for line in output.decode("utf-8", "replace").splitlines():
+            if line.startswith(BENCH_RESULT + " "):
+                result = json.loads(line[len(BENCH_RESULT) + 1:])
+
+        result["total"] = sum(result["phases"].values())
+        if best is None or result["total"] < best["total"]:
+            best = result
+
+    best["mappers"] = num_of_mappers
+    best["reducers"] = num_of_reducers
+    best["throughput"] = os.path.getsize(corpus) / float(1 << 20) / best["total"]
+
+    return best
+
+
+def find_regressions(results, baseline, threshold):
+
+    """
+    Function to compare the runs against those of the baseline with the same numbers of mappers and reducers
+    A run regresses when its total time, the time of one of its phases or its peak memory exceeds that of the baseline by more than the threshold
+
+    Inputs -
+    results: the benchmark results
+    baseline: the results stored as the baseline
+    threshold: the share by which a measurement may exceed the baseline, for example 0.1 for 10%
+
+    Output -
+    List of the regressions, each a dictionary naming the run, the measurement and both values
+    """
+
+    baseline_runs = dict(((run["mappers"], run["reducers"]), run) for run in baseline["runs"])
+    regressions = []
+
+    for run in results["runs"]:
+        baseline_run = baseline_runs.get((run["mappers"], run["reducers"]))
+        if baseline_run is None:
+            continue
+
+        measurements = [("total", run["total"], baseline_run["total"]), ("peak_rss", run["peak_rss"], baseline_run["peak_rss"])]
+        measurements.extend((phase, run["phases"][phase], baseline_run["phases"][phase]) for phase in PHASES)
+
+        for (measurement, value, baseline_value) in measurements:
+            if measurement != "peak_rss" and baseline_value < MIN_COMPARED_TIME:
+                continue
+            if value > baseline_value * (1 + threshold):
+                regressions.append({"mappers": run["mappers"], "reducers": run["reducers"], "measurement": measurement,
+                                    "value": value, "baseline": baseline_value})
+
+    return regressions
+
+
+def run_benchmarks(taskfile, size, vocabulary, exponent, seed, mapper_counts, reducer_counts, repeat):
+
+    """
+    Master function to benchmark the job over the whole grid of mapper and reducer counts
+
+    Inputs -
+    taskfile: path of the task file
+    size, vocabulary, exponent, seed: parameters of the corpus, as for generate_corpus()
+    mapper_counts, reducer_counts: lists of the numbers of map and reduce tasks to run with
+    repeat: number of runs of every point of the grid, the fastest is kept
+
+    Output -
+    Dictionary holding the corpus and environment descriptions and the results of every run
+    """
+
+    corpus = get_corpus(size, vocabulary, exponent, seed)
+    results = {
+        "corpus": {"path": corpus, "size": os.path.getsize(corpus), "vocabulary": vocabulary, "exponent": exponent, "seed": seed},
+        "environment": {"python": platform.python_version(), "platform": sys.platform, "cpus": multiprocessing.cpu_count()},
+        "runs": [],
+    }
+
+    for num_of_mappers in mapper_counts:
+        for num_of_reducers in reducer_counts:
+            run = run_configuration(taskfile, corpus, num_of_mappers, num_of_reducers, repeat)
+            results["runs"].append(run)
+            print("%d mappers, %d reducers: %.2fs, %.1f MB/s, %.0f MB peak" % (num_of_mappers, num_of_reducers, run["total"], run["throughput"], run["peak_rss"]),
+                  file=sys.stderr)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    # Worker mode - invoked by run_configuration() for every run
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]))
+        sys.exit(0)
+
+    # Example - python3 bench.py --size 64M -m 1,2,4,8 -r 1,4 --baseline bench_baseline.json
+    parser = argparse.ArgumentParser(description="Benchmark a MapReduce job over a synthetic Zipf-distributed corpus")
+    parser.add_argument('--taskfile', default='wordcount_example.py', help="task file defining the job")
+    parser.add_argument('--size', default='16M', help="size of the corpus, with an optional K, M or G suffix")
+    parser.add_argument('--vocabulary', type=int, default=100000, help="number of distinct words in the corpus")
+    parser.add_argument('--exponent', type=float, default=1.0, help="exponent of the Zipf distribution of the words")
+    parser.add_argument('--seed', type=int, default=1, help="seed the corpus is generated with")
+    parser.add_argument('-m', '--mappers', default='1,2,4', help="comma-separated numbers of map tasks")
+    parser.add_argument('-r', '--reducers', default='1,4', help="comma-separated numbers of reduce tasks")
+    parser.add_argument('--repeat', type=int, default=1, help="number of runs of every configuration, the fastest is kept")
+    parser.add_argument('--output', help="file to write the results to, as well as the standard output")
+    parser.add_argument('--baseline', help="baseline results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline instead of comparing against it")
+    parser.add_argument('--threshold', type=float, default=0.1, help="share by which a measurement may exceed the baseline before it is flagged")
+    args = parser.parse_args()
+
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs the --baseline file to store the results in")
+
+    results = run_benchmarks(args.taskfile, parse_size(args.size), args.vocabulary, args.exponent, args.seed,
+                             [int(count) for count in args.mappers.split(',')], [int(count) for count in args.reducers.split(',')], args.repeat)
+
+    # Compare against the baseline, unless it is being replaced
+    regressions = []
+    if args.baseline and not args.save_baseline:
+        baseline_file = open(args.baseline, "r")
+        baseline = json.load(baseline_file)
+        baseline_file.close()
+
+        if baseline["corpus"] != results["corpus"]:
+            print("Warning: the baseline was run on another corpus", file=sys.stderr)
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        results["regressions"] = regressions
+        for regression in regressions:
+            print("Regression - %(mappers)d mappers, %(reducers)d reducers, %(measurement)s: %(value).2f against %(baseline).2f" % regression, file=sys.stderr)
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    print(report)
+
+    for filename in [args.output, args.baseline if args.save_baseline else None]:
+        if filename:
+            report_file = open(filename, "w")
+            report_file.write(report + "\n")
+            report_file.close()
+
+    # A failing exit status lets a build flag the regressions
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,230 @@
+# Compression codecs for the intermediate and reducer output files - the shuffle is often bound by the storage rather than the CPU
+import bz2
+import os
+import time
+import zlib
+
+import fileNameRetriever
+
+try:
+    import lzma
+except ImportError:
+    # lzma only ships with Python 3
+    lzma = None
+
+
+# Number of compressed bytes read at a time
+BLOCK_SIZE = 1 << 16
+
+# Compression level used by the zlib codec - the fast end, since the point is to save I/O time
+ZLIB_LEVEL = 1
+
+# Compression level used by the lzma codec
+LZMA_PRESET = 1
+
+
+# Codecs available to a job, by name - every one is a pair of functions creating a fresh compressor and decompressor
+CODECS = {
+    "zlib": (lambda: zlib.compressobj(ZLIB_LEVEL), zlib.decompressobj),
+    "bz2": (bz2.BZ2Compressor, bz2.BZ2Decompressor),
+}
+
+if lzma is not None:
+    CODECS["lzma"] = (lambda: lzma.LZMACompressor(preset=LZMA_PRESET), lzma.LZMADecompressor)
+
+
+def get_codec(name):
+
+    """
+    Function to check a codec name
+
+    Input -
+    name: one of the names in CODECS, or None for no compression
+
+    Output -
+    The name, if the codec is available
+    """
+
+    if not(name is None or name in CODECS):
+        raise ValueError("Unknown or unavailable codec: " + str(name))
+
+    return name
+
+
+# Writer compressing everything written to it into an open file
+class CompressedWriter(object):
+
+    def __init__(self, file, codec):
+
+        """
+        Constructor to initialize the writer
+
+        Inputs -
+        file: the underlying file, opened in binary mode
+        codec: name of the codec
+        """
+
+        self.file = file
+        self.compressor = CODECS[codec][0]()
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def close(self):
+
+        # Write out whatever the compressor still holds before closing the file
+        self.file.write(self.compressor.flush())
+        self.file.close()
+
+
+# Reader decompressing an open file, or anything else with a read(size) method, as it is read
+class CompressedReader(object):
+
+    def __init__(self, file, codec):
+
+        """
+        Constructor to initialize the reader
+
+        Inputs -
+        file: the underlying file, opened in binary mode
+        codec: name of the codec
+        """
+
+        self.file = file
+        self.decompressor = CODECS[codec][1]()
+        self.buffer = b""
+        self.position = 0
+        self.finished = False
+
+    def fill(self):
+
+        """
+        Function to decompress the next block of the underlying file into the buffer
+
+        Output -
+        Boolean True/False signifying whether there was anything left to decompress
+        """
+
+        while not self.finished:
+            block = self.file.read(BLOCK_SIZE)
+            if block:
+                data = self.decompressor.decompress(block)
+            else:
+                self.finished = True
+                data = self.decompressor.flush() if hasattr(self.decompressor, "flush") else b""
+
+            # A block may not decompress to anything yet, keep reading until it does
+            if data:
+                self.buffer, self.position = data, 0
+                return True
+
+        return False
+
+    def read(self, size = -1):
+
+        """
+        Function to read up to size decompressed bytes, or everything left if size is negative
+
+        Input -
+        size: Number of bytes to read
+
+        Output -
+        The bytes read, fewer than size only at the end of the file
+        """
+
+        pieces = []
+        needed = size
+        while size < 0 or needed > 0:
+
+            # Move on to the next block once the current one has been used up
+            if self.position >= len(self.buffer) and not self.fill():
+                break
+
+            if size < 0:
+                end = len(self.buffer)
+            else:
+                end = min(len(self.buffer), self.position + needed)
+                needed -= end - self.position
+
+            pieces.append(self.buffer[self.position:end])
+            self.position = end
+
+        return b"".join(pieces)
+
+    def close(self):
+        self.file.close()
+
+
+def writer(file, codec):
+
+    """
+    Function to wrap a file opened for writing so that it is compressed with the codec
+
+    Inputs -
+    file: the open file
+    codec: name of the codec, or None for no compression
+
+    Output -
+    The file to write to
+    """
+
+    return CompressedWriter(file, codec) if codec else file
+
+
+def reader(file, codec):
+
+    """
+    Function to wrap a file opened for reading so that it is decompressed with the codec
+
+    Inputs -
+    file: the open file, or anything else with a read(size) method
+    codec: name of the codec, or None for no compression
+
+    Output -
+    The file to read from
+    """
+
+    return CompressedReader(file, codec) if codec else file
+
+
+def choose_codec(sample, directory):
+
+    """
+    Function to pick the codec that writes a sample of the data out the fastest, or None if compressing does not pay off
+    The time to write the sample out as it is is measured first, every codec then costs its compression time plus the time to write its smaller output
+
+    Inputs -
+    sample: bytes as they would be written out uncompressed
+    directory: directory the files are to be written to, its write throughput is measured
+
+    Output -
+    Name of the fastest codec, or None
+    """
+
+    if not sample:
+        return None
+
+    # Measure the write throughput of the directory, through to the disk
+    probe_name = fileNameRetriever.get_attempt_filename(os.path.join(directory, "codec_probe"))
+    start = time.time()
+    probe = open(probe_name, "wb")
+    probe.write(sample)
+    probe.flush()
+    os.fsync(probe.fileno())
+    probe.close()
+    write_time = max(time.time() - start, 1e-6)
+    os.unlink(probe_name)
+
+    throughput = len(sample) / write_time
+    best_codec, best_time = None, write_time
+
+    for codec in sorted(CODECS):
+        start = time.time()
+        compressor = CODECS[codec][0]()
+        compressed_size = len(compressor.compress(sample)) + len(compressor.flush())
+        codec_time = time.time() - start + compressed_size / throughput
+
+        if codec_time < best_time:
+            best_codec, best_time = codec, codec_time
+
+    return best_codec
@@ -0,0 +1,429 @@
+# Job coordinator - spreads the map and reduce tasks of a job across a list of nodes and tracks their completion
+# Replaces 44controller.sh. Every node runs this same file in worker mode, over ssh or, with --local, as a local subprocess
+import argparse
+import importlib
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from shlex import quote
+except ImportError:
+    # shlex.quote is only there from Python 3.3
+    from pipes import quote
+
+from mapreduce import MapReduce, MAX_TASK_ATTEMPTS
+
+
+# Prefix of the lines a worker prints once a task is done
+TASK_DONE = "TASK_DONE"
+
+# Number of seconds between two checks on the running tasks
+POLL_INTERVAL = 0.1
+
+# A task is behind once it has run SPECULATION_FACTOR times as long as the median completed task, plus SPECULATION_SLACK seconds
+SPECULATION_FACTOR = 2.0
+SPECULATION_SLACK = 1.0
+
+# Share of the tasks of a phase that must have completed before any backup attempt is started
+SPECULATION_MIN_DONE = 0.5
+
+
+def load_job(taskfile):
+
+    """
+    Function to import a task file and find the job class it defines
+
+    Input -
+    taskfile: path of the task file, for example wordcount_example.py
+
+    Output -
+    The subclass of MapReduce defined in the task file
+    """
+
+    # Import the task file as a module
+    sys.path.insert(0, os.path.dirname(os.path.abspath(taskfile)))
+    module = importlib.import_module(os.path.splitext(os.path.basename(taskfile))[0])
+
+    for name in dir(module):
+        candidate = getattr(module, name)
+        if isinstance(candidate, type) and issubclass(candidate, MapReduce) and candidate is not MapReduce:
+            return candidate
+
+    raise ValueError("No MapReduce job found in " + taskfile)
+
+
+# Class tracking a single attempt of a task, run by a worker process
+class Attempt(object):
+
+    def __init__(self, task_id, node, process):
+
+        """
+        Constructor to start tracking the attempt
+
+        Inputs -
+        task_id: the task being run
+        node: name of the node running it
+        process: the worker process
+        """
+
+        self.task_id = task_id
+        self.node = node
+        self.process = process
+        self.start = time.time()
+        self.done = False
+
+        # Read the output of the worker in the background, the task is done once the worker reports it
+        self.tracker = threading.Thread(target=self.track)
+        self.tracker.daemon = True
+        self.tracker.start()
+
+
+    def track(self):
+
+        # Pass the output of the worker through, and pick up the completion of the task
+        for line in iter(self.process.stdout.readline, b''):
+            line = line.decode('utf-8', 'replace').rstrip()
+            if line.startswith(TASK_DONE):
+                self.done = True
+            else:
+                print("[" + self.node + "] " + line)
+
+
+    def finished(self):
+
+        """
+        Function to check whether the worker has exited, its output is then fully read
+        """
+
+        if self.process.poll() is None:
+            return False
+
+        self.tracker.join()
+        return True
+
+
+    def kill(self):
+
+        """
+        Function to kill the worker along with its pool of processes
+        """
+
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+        self.process.wait()
+
+
+# Class handing out the tasks of a job to the nodes and waiting for them to complete
+class Coordinator(object):
+
+    def __init__(self, taskfile, nodes, num_of_mappers = 4, num_of_reducers = 4, local = False, remote_dir = 'ddpsA2', python = 'python3', slow_nodes = None, input_path = 'input', options = None):
+
+        """
+        Constructor to initialize the job and the nodes it runs on
+
+        Inputs -
+        taskfile: path of the task file, for example wordcount_example.py
+        nodes: list of node names, a node may be listed several times to give it more tasks
+        num_of_mappers, num_of_reducers: number of map and reduce tasks
+        local: Boolean flag to run every worker as a local subprocess instead of over ssh, the node names are then only labels
+        remote_dir: directory holding the code on the nodes, it has to share the input and output directories with the coordinator
+        python: interpreter to run the workers with on the nodes
+        slow_nodes: dictionary of node names and a delay in seconds added to every task run on them - for testing speculative execution
+        input_path: input of the job, read in place - a file, a directory or a glob pattern, relative to remote_dir on the nodes
+        options: list of the options to run the job with, out of mapreduce.JOB_OPTIONS - 'metrics', 'profile' and 'allocations'
+        """
+
+        self.taskfile = taskfile
+        self.nodes = nodes
+        self.num_of_mappers = num_of_mappers
+        self.num_of_reducers = num_of_reducers
+        self.local = local
+        self.remote_dir = remote_dir
+        self.python = python
+        self.slow_nodes = slow_nodes or {}
+        self.input_path = input_path
+        self.options = options or []
+        self.job = None
+
+
+    def prepare(self):
+
+        """
+        Function to clear out the previous run - the input itself is read in place, nothing is copied
+        """
+
+        # Clear out the outputs and splits of the previous run
+        for directory in ['output', 'input']:
+            for name in os.listdir(directory):
+                if name.endswith('.ext') or (directory == 'output' and os.path.isfile(os.path.join(directory, name))):
+                    os.unlink(os.path.join(directory, name))
+
+
+    def worker_command(self, node, phase, task_ids):
+
+        """
+        Function to build the command starting a worker on a node
+
+        Inputs -
+        node: name of the node
+        phase: 'map' or 'reduce'
+        task_ids: list of the task IDs the worker is to run
+
+        Output -
+        The command, as a list of arguments
+        """
+
+        arguments = ['worker', self.taskfile, str(self.num_of_mappers), str(self.num_of_reducers), phase, ','.join(str(task) for task in task_ids),
+                     str(self.slow_nodes.get(node, 0)), self.input_path, ','.join(self.options) or '-']
+
+        # Local workers stand in for the nodes and run with the current interpreter
+        if self.local:
+            return [sys.executable, os.path.abspath(__file__)] + arguments
+
+        # The remote shell must not expand a glob pattern given as the input
+        return ['ssh', node, 'cd ' + self.remote_dir + ' && ' + ' '.join([self.python, 'coordinator.py'] + [quote(argument) for argument in arguments])]
+
+
+    def launch(self, node, phase, task_id):
+
+        """
+        Function to start an attempt of a task on a node
+
+        Inputs -
+        node: name of the node
+        phase: 'map' or 'reduce'
+        task_id: the task to run
+
+        Output -
+        The Attempt started
+        """
+
+        # The worker gets its own process group, so that a losing attempt can be killed along with its pool of processes
+        process = subprocess.Popen(self.worker_command(node, phase, [task_id]), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+        return Attempt(task_id, node, process)
+
+
+    def find_straggler(self, running, durations, backed_up, num_tasks):
+
+        """
+        Function to find the running task furthest behind its peers, if any is clearly behind
+        A task is behind once it has been running SPECULATION_FACTOR times as long as the median completed task, plus SPECULATION_SLACK seconds
+        Nothing is considered behind until SPECULATION_MIN_DONE of the tasks of the phase have completed
+
+        Inputs -
+        running: list of the running attempts
+        durations: dictionary of the completed tasks and how long they took
+        backed_up: set of the tasks already given a backup attempt
+        num_tasks: number of tasks in the phase
+
+        Output -
+        The attempt of the straggling task, or None
+        """
+
+        if not durations or len(durations) < SPECULATION_MIN_DONE * num_tasks:
+            return None
+
+        median = sorted(durations.values())[len(durations) // 2]
+        now = time.time()
+        stragglers = [attempt for attempt in running if not(attempt.task_id in backed_up) and not(attempt.task_id in durations)
+                      and now - attempt.start > SPECULATION_FACTOR * median + SPECULATION_SLACK]
+
+        if not stragglers:
+            return None
+
+        return min(stragglers, key=lambda attempt: attempt.start)
+
+
+    def run_phase(self, phase, task_ids):
+
+        """
+        Function to run every task of a phase and wait for all of them to complete
+        Every node listed runs one task at a time and is handed the next pending task as soon as it is free
+        Once there are no pending tasks left, free nodes run backup attempts of the tasks that are clearly behind
+        Whichever attempt of a task completes first wins, the others are killed
+        A task whose attempts all failed is queued up again, up to MAX_TASK_ATTEMPTS times, and completed tasks are recorded in the manifest of the job
+
+        Inputs -
+        phase: 'map' or 'reduce'
+        task_ids: list of task IDs
+
+        Output -
+        Set of the task IDs that completed
+        """
+
+        pending = list(task_ids)
+        free_nodes = list(self.nodes)
+        running = []
+        durations = {}
+        backed_up = set()
+        failures = dict((task_id, 0) for task_id in task_ids)
+
+        while len(durations) < len(task_ids):
+
+            # Pick up the attempts that have finished
+            for attempt in [attempt for attempt in running if attempt.finished()]:
+                running.remove(attempt)
+                free_nodes.append(attempt.node)
+
+                # First attempt to complete wins - the other attempts of the task are wasted work
+                if attempt.done and not(attempt.task_id in durations):
+                    durations[attempt.task_id] = time.time() - attempt.start
+                    self.job.manifest.mark_completed(phase, [attempt.task_id])
+                    for other in running:
+                        if other.task_id == attempt.task_id:
+                            other.kill()
+
+                # A failed attempt is only run again if no other attempt of the task is still running
+                elif not(attempt.done or attempt.task_id in durations or [other for other in running if other.task_id == attempt.task_id]):
+                    failures[attempt.task_id] += 1
+                    if failures[attempt.task_id] < MAX_TASK_ATTEMPTS:
+                        print(phase + " task " + str(attempt.task_id) + " failed on " + attempt.node + ", queueing it up again")
+                        pending.append(attempt.task_id)
+
+            # Hand out the pending tasks first, then backups of the stragglers
+            while free_nodes:
+                if pending:
+                    running.append(self.launch(free_nodes.pop(0), phase, pending.pop(0)))
+                    continue
+
+                straggler = self.find_straggler(running, durations, backed_up, len(task_ids))
+                other_nodes = [node for node in free_nodes if node != getattr(straggler, 'node', None)]
+                if straggler is None or not other_nodes:
+                    break
+
+                print(phase + " task " + str(straggler.task_id) + " is behind on " + straggler.node + ", starting a backup on " + other_nodes[0])
+                backed_up.add(straggler.task_id)
+                free_nodes.remove(other_nodes[0])
+                running.append(self.launch(other_nodes[0], phase, straggler.task_id))
+
+            # Nothing is running and nothing more can be started - the remaining tasks failed
+            if not running:
+                break
+
+            time.sleep(POLL_INTERVAL)
+
+        # Kill whatever attempts are left, they lost to another attempt
+        for attempt in running:
+            attempt.kill()
+            attempt.finished()
+
+        print(phase + " phase: " + str(len(durations)) + "/" + str(len(task_ids)) + " tasks completed")
+        return set(durations)
+
+
+    def run(self, top_k = 25):
+
+        """
+        Master function to run the whole job - the map phase, the reduce phase and the final join
+        The tasks the manifest records as completed, by an earlier run of the job, are skipped
+
+        Input -
+        top_k: number of records of the joined output to return
+
+        Output -
+        The top_k records of the joined output
+        """
+
+        # Set up the job once, so that the input is split and the manifest started before any worker starts
+        self.job = load_job(self.taskfile)(self.input_path, 'output', self.num_of_mappers, self.num_of_reducers)
+        self.job.enable_options(self.options)
+
+        # Map outputs of an earlier run only apply if it partitioned them for as many reducers
+        self.job.manifest.repartition(self.num_of_reducers)
+
+        for (phase, num_tasks) in [('map', self.num_of_mappers), ('reduce', self.num_of_reducers)]:
+            task_ids = self.job.pending_tasks(phase, list(range(num_tasks)))
+            if len(task_ids) < num_tasks:
+                print(phase + " phase: " + str(num_tasks - len(task_ids)) + " tasks already completed")
+
+            start = time.time()
+            completed = self.run_phase(phase, task_ids)
+            self.job.recorder.record(phase, start, 'phase')
+            self.job.write_job_metrics()
+            self.job.write_profile_reports(phase)
+            missing = sorted(set(task_ids) - completed)
+            if missing:
+                raise RuntimeError(phase + " tasks failed: " + ', '.join(str(task) for task in missing))
+
+        # Join the outputs of all the reducers, the intermediate files are deleted along with the manifest once it has gone through
+        return self.job.join_outputs(top_k=top_k)
+
+
+def run_worker(taskfile, num_of_mappers, num_of_reducers, phase, task_ids, delay = 0, input_path = 'input', options = None):
+
+    """
+    Function run on every node - runs the given tasks of a phase and reports each one as it completes
+
+    Inputs -
+    taskfile: path of the task file
+    num_of_mappers, num_of_reducers: number of map and reduce tasks of the whole job
+    phase: 'map' or 'reduce'
+    task_ids: list of the task IDs to run on this node
+    delay: number of seconds every task is held up by, to stand in for a slow node
+    input_path: input of the job - a file, a directory or a glob pattern
+    options: list of the options to run the job with, out of mapreduce.JOB_OPTIONS
+    """
+
+    job = load_job(taskfile)(input_path, 'output', num_of_mappers, num_of_reducers)
+    job.enable_options(options or [])
+    controller = job.mapper_controller if phase == 'map' else job.reducer_controller
+
+    def run_task(task_id):
+        time.sleep(delay)
+        controller(task_id)
+        sys.stdout.write(TASK_DONE + " " + phase + " " + str(task_id) + "\n")
+        sys.stdout.flush()
+
+    job.run_tasks(run_task, task_ids)
+
+
+if __name__ == '__main__':
+
+    # Worker mode - invoked by the coordinator on every node
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5], [int(task) for task in sys.argv[6].split(',')], float(sys.argv[7]),
+                   sys.argv[8] if len(sys.argv) > 8 else 'input', [option for option in sys.argv[9].split(',') if option != '-'] if len(sys.argv) > 9 else [])
+        sys.exit(0)
+
+    # Example - python3 coordinator.py wordcount_example.py large.txt node109 node110 node111 -m 8 -r 4
+    parser = argparse.ArgumentParser(description="Run a MapReduce job across a list of nodes")
+    parser.add_argument('taskfile', help="task file defining the job, for example wordcount_example.py")
+    parser.add_argument('data_file', help="data file, directory of files or glob pattern under input/data")
+    parser.add_argument('nodes', nargs='+', help="nodes to run the tasks on")
+    parser.add_argument('-m', '--mappers', type=int, default=4, help="number of map tasks")
+    parser.add_argument('-r', '--reducers', type=int, default=4, help="number of reduce tasks")
+    parser.add_argument('--local', action='store_true', help="run the workers as local subprocesses instead of over ssh")
+    parser.add_argument('--remote-dir', default='ddpsA2', help="directory holding the code on the nodes")
+    parser.add_argument('--python', default='python3', help="interpreter to run the workers with on the nodes")
+    parser.add_argument('--resume', action='store_true', help="resume the previous run of the job, skipping the tasks it completed")
+    parser.add_argument('--metrics', action='store_true', help="collect the metrics of every phase and task into output/metrics.json and output/trace.json")
+    parser.add_argument('--profile', action='store_true', help="profile every task with cProfile, into a report per phase under output/profile_<phase>.txt")
+    parser.add_argument('--trace-allocations', action='store_true', help="trace the memory held by every task with tracemalloc, into a report per phase under output/allocations_<phase>.txt")
+    parser.add_argument('--slow-node', action='append', default=[], metavar='NODE:SECONDS', help="hold up every task run on the node, for testing speculative execution")
+    args = parser.parse_args()
+
+    slow_nodes = dict((node, float(seconds)) for (node, seconds) in (slow_node.rsplit(':', 1) for slow_node in args.slow_node))
+
+    options = [option for (option, flag) in [('metrics', args.metrics), ('profile', args.profile), ('allocations', args.trace_allocations)] if flag]
+
+    coordinator = Coordinator(args.taskfile, args.nodes, args.mappers, args.reducers, args.local, args.remote_dir, args.python, slow_nodes,
+                              os.path.join('input', 'data', args.data_file), options)
+
+    # A resumed job keeps the outputs of the previous run
+    if not args.resume:
+        coordinator.prepare()
+
+    top_words = coordinator.run()
+
+    print("\n\nPrinting top 25 most frequent words and their frequencies:")
+    for (word, count) in top_words:
+        if isinstance(word, bytes):
+            word = word.decode("utf-8", "replace")
+        print(word + " " + str(count))
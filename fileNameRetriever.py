@@ -1,3 +1,8 @@
+import glob
+import os
+import socket
+
+
 def get_filename(input_dir = None, ext = ".ext"):
 
     """
@@ -12,6 +17,51 @@ def get_filename(input_dir = None, ext = ".ext"):
     return "input/file" + ext
 
 
+def get_input_files(input_path = None):
+
+    """
+    Function to list the input files of a job, read in place. The input path may be
+    - a directory holding the primary input file (file.ext), which is then the only input, as before
+    - any other directory, every file under it is an input, bar the .ext files the jobs write (such as the split files)
+    - a glob pattern, every file matching it is an input
+    - a single file
+    """
+
+    if input_path is None:
+        input_path = "input"
+
+    # A directory holding the primary input file
+    if os.path.isdir(input_path) and os.path.isfile(get_filename(input_path)):
+        return [get_filename(input_path)]
+
+    # Every file under the directory, in a stable order
+    if os.path.isdir(input_path):
+        paths = []
+        for (directory, subdirectories, filenames) in os.walk(input_path):
+            subdirectories.sort()
+            paths.extend(os.path.join(directory, filename) for filename in sorted(filenames) if not(filename.startswith(".") or filename.endswith(".ext")))
+        return paths
+
+    # Every file matching the pattern, or the file itself
+    return sorted(path for path in glob.glob(input_path) if os.path.isfile(path))
+
+
+def get_bench_corpus_filename(size, vocabulary, exponent, seed, data_dir = None):
+
+    """
+    These files hold the synthetic corpora generated by the benchmarks, named after the parameters they were generated with. This function accesses the corresponding file
+    """
+
+    name = "zipf_" + str(size) + "_" + str(vocabulary) + "_" + str(exponent) + "_" + str(seed) + ".txt"
+
+    # Navigate to data directory and access the specific corpus
+    if not(data_dir is None):
+        return data_dir + "/" + name
+
+    # Data directory is 'input/data' by default
+    return "input/data/" + name
+
+
 def get_split_filename(index, input_dir = None, extension = ".ext"):
 
     """
@@ -26,12 +76,55 @@ def get_split_filename(index, input_dir = None, extension = ".ext"):
     return "input/file_" + str(index) + extension
 
 
-def get_intermediate_file(index, reducer, output_dir = None, extension = ".ext"):
+def get_split_table_filename(output_dir = None, extension = ".ext"):
+
+    """
+    This file holds the (offset, length) range of every virtual split, next to the manifest of the job. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/splits" + extension
+
+    # Output directory is 'output' by default
+    return "output/splits" + extension
+
+
+def get_manifest_filename(output_dir = None, extension = ".ext"):
+
+    """
+    This file records the splits of the job and the tasks that have completed. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/manifest" + extension
+
+    # Output directory is 'output' by default
+    return "output/manifest" + extension
+
+
+def get_codec_extension(extension, codec = None):
+
+    """
+    Files compressed with a codec have its name appended to their extension. This function builds the extension
+    """
+
+    if codec is None:
+        return extension
+
+    return extension + "." + codec
+
+
+def get_intermediate_file(index, reducer, output_dir = None, extension = ".ext", codec = None):
 
     """
     These files are output by the mapper as intermediate files. This function accesses the corresponding files
     """
 
+    # Compressed files carry the name of their codec
+    extension = get_codec_extension(extension, codec)
+
     # Navigate to output directory and access the specific file
     if not(output_dir is None):
         return output_dir + "/map_file_" + str(index)+"-" + str(reducer) + extension
@@ -41,12 +134,66 @@ def get_intermediate_file(index, reducer, output_dir = None, extension = ".ext")
 
 
 
-def get_reduce_filename(file_index, output_dir = None, ext = ".out"):
+def get_spill_file(index, reducer, run, output_dir = None, extension = ".ext", codec = None):
+
+    """
+    These files are sorted runs spilled by the mapper when its output buffer is full. This function accesses the corresponding files
+    """
+
+    # Compressed files carry the name of their codec
+    extension = get_codec_extension(extension, codec)
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/spill_file_" + str(index) + "-" + str(reducer) + "-" + str(run) + extension
+
+    # Output directory is 'output' by default 
+    return "output/spill_file_" + str(index) + "-" + str(reducer) + "-" + str(run) + extension
+
+
+def get_hot_keys_file(index, output_dir = None, extension = ".ext", codec = None):
+
+    """
+    These files list the hot keys a mapper split across several reducers. This function accesses the corresponding files
+    """
+
+    # Compressed files carry the name of their codec
+    extension = get_codec_extension(extension, codec)
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/hot_keys_" + str(index) + extension
+
+    # Output directory is 'output' by default 
+    return "output/hot_keys_" + str(index) + extension
+
+
+def get_hot_reduce_filename(file_index, output_dir = None, ext = ".out", codec = None):
+
+    """
+    These files are output by the reducer and hold the partial results of the hot keys. This function accesses the corresponding files
+    """
+
+    # Compressed files carry the name of their codec
+    ext = get_codec_extension(ext, codec)
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/hot_file_" + str(file_index) + ext
+
+    # Output directory is 'output' by default 
+    return "output/hot_file_" + str(file_index) + ext
+
+
+def get_reduce_filename(file_index, output_dir = None, ext = ".out", codec = None):
 
     """
     These files are output by the reducer as intermediate files. This function accesses the corresponding files
     """
 
+    # Compressed files carry the name of their codec
+    ext = get_codec_extension(ext, codec)
+
     # Navigate to output directory and access the specific file
     if not(output_dir is None):
         return output_dir+"/reduce_file_"+ str(file_index) + ext
@@ -66,4 +213,142 @@ def get_output_filename(out_directory = None, ext = ".out"):
         return out_directory +"/output" + ext
 
     # Output directory is 'output' by default 
-    return "output/output" + ext
\ No newline at end of file
+    return "output/output" + ext
+
+
+def get_metrics_file(name, output_dir = None):
+
+    """
+    These files hold the metrics recorded by a single process or task of the job, until they are merged into the report. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/metrics_" + name + ".json"
+
+    # Output directory is 'output' by default
+    return "output/metrics_" + name + ".json"
+
+
+def get_metrics_report_filename(output_dir = None):
+
+    """
+    This file holds the metrics of the whole job, merged from those of all its processes. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the report
+    if not(output_dir is None):
+        return output_dir + "/metrics.json"
+
+    # Output directory is 'output' by default
+    return "output/metrics.json"
+
+
+def get_trace_filename(output_dir = None):
+
+    """
+    This file holds the timeline of the whole job as Chrome trace events. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the trace
+    if not(output_dir is None):
+        return output_dir + "/trace.json"
+
+    # Output directory is 'output' by default
+    return "output/trace.json"
+
+
+def get_profile_file(phase, task_id = None, output_dir = None):
+
+    """
+    These files hold the cProfile stats of a single task, or merged over a whole phase if no task ID is given. This function accesses the corresponding file
+    """
+
+    name = "profile_" + phase + ("" if task_id is None else "_" + str(task_id)) + ".prof"
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/" + name
+
+    # Output directory is 'output' by default
+    return "output/" + name
+
+
+def get_profile_report_filename(phase, output_dir = None):
+
+    """
+    This file holds the report of the cProfile stats of a phase. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the report
+    if not(output_dir is None):
+        return output_dir + "/profile_" + phase + ".txt"
+
+    # Output directory is 'output' by default
+    return "output/profile_" + phase + ".txt"
+
+
+def get_allocations_file(phase, task_id, output_dir = None):
+
+    """
+    These files hold the tracemalloc snapshot of a single task. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the specific file
+    if not(output_dir is None):
+        return output_dir + "/allocations_" + phase + "_" + str(task_id) + ".snapshot"
+
+    # Output directory is 'output' by default
+    return "output/allocations_" + phase + "_" + str(task_id) + ".snapshot"
+
+
+def get_allocations_report_filename(phase, output_dir = None):
+
+    """
+    This file holds the report of the memory allocated by the tasks of a phase. This function accesses the corresponding file
+    """
+
+    # Navigate to output directory and access the report
+    if not(output_dir is None):
+        return output_dir + "/allocations_" + phase + ".txt"
+
+    # Output directory is 'output' by default
+    return "output/allocations_" + phase + ".txt"
+
+
+def get_cache_entry(digest, cache_dir = None):
+
+    """
+    This directory holds the cached map outputs of a split, named after the digest of the split and the job. This function accesses the corresponding directory
+    """
+
+    # Navigate to cache directory and access the specific entry
+    if not(cache_dir is None):
+        return cache_dir + "/" + digest
+
+    # Cache directory is 'cache' by default
+    return "cache/" + digest
+
+
+def get_input_index_filename(digest, cache_dir = None):
+
+    """
+    This file holds the index of a compressed input file, named after the digest of the file. This function accesses the corresponding file
+    """
+
+    # Navigate to cache directory and access the specific index
+    if not(cache_dir is None):
+        return cache_dir + "/" + digest + ".index"
+
+    # Cache directory is 'cache' by default
+    return "cache/" + digest + ".index"
+
+
+def get_attempt_filename(filename):
+
+    """
+    These files are written by a single attempt of a task and renamed into place once complete. This function accesses the corresponding file
+    """
+
+    # Name the file after the host and process running the attempt, so that concurrent attempts never write to the same file
+    return filename + "." + socket.gethostname() + "-" + str(os.getpid())
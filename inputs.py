@@ -0,0 +1,577 @@
+# Input files of a job - any number of files, read in place as if they were a single stream of bytes
+# gzip, bz2 and zip files are decompressed as they are read, nothing is ever decompressed to disk
+import bisect
+import bz2
+import hashlib
+import json
+import mmap
+import os
+import re
+import zipfile
+import zlib
+
+import fileNameRetriever
+
+
+# Whitespace characters on which the input may be split
+WHITESPACE = re.compile(br"\s")
+
+# Separator put between the contents of two files read as part of the same split, so that no word runs across files
+FILE_SEPARATOR = b"\n"
+
+# Number of compressed bytes read at a time
+COMPRESSED_BLOCK_SIZE = 1 << 16
+
+# Minimum number of decompressed bytes between two seek points of a compressed file
+# A seek point is where a fresh decompressor can start, i.e. the start of a gzip member or bz2 stream
+SEEK_POINT_SPACING = 1 << 22
+
+# Number of decompressed bytes between two split points recorded in the index of a compressed file
+# Splits of a compressed file start and end on these points only, since finding any other one means decompressing
+SPLIT_POINT_SPACING = 1 << 16
+
+# Magic number starting every member of a gzip file and every stream of a bz2 file
+GZIP_MAGIC = b"\x1f\x8b"
+BZ2_MAGIC = b"BZh"
+
+
+# A single input file, read in place
+class InputFile(object):
+
+    def __init__(self, path):
+
+        """
+        Constructor to initialize the file
+
+        Input -
+        path: path of the file
+        """
+
+        self.path = path
+        self.size = os.path.getsize(path)
+
+
+    def find_split_point(self, offset):
+
+        """
+        Function to find a valid split point at or after the given offset, i.e:
+        - The split cannot be in the middle of a string/number
+        - The split happens right after the first whitespace character found from the offset onwards
+
+        Input -
+        offset: the byte offset the split would ideally happen at
+
+        Output -
+        The byte offset at which the next split starts, or the size of the file if no whitespace is left
+        """
+
+        # An empty file cannot be memory-mapped
+        if offset >= self.size:
+            return self.size
+
+        # Search the mapped file directly, so nothing before the offset is read into memory
+        file = open(self.path, "rb")
+        mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        match = WHITESPACE.search(mapped_file, offset)
+        mapped_file.close()
+        file.close()
+
+        # No whitespace left - the remainder of the file belongs to the current split
+        if match is None:
+            return self.size
+
+        return match.end()
+
+
+    def read_blocks(self, start, end, block_size):
+
+        """
+        Generator to read a byte range of the file, one block at a time
+
+        Inputs -
+        start, end: the byte range [start, end) to read
+        block_size: number of bytes read at a time, the whole range is read at once if None
+
+        Output -
+        Generator of the blocks read
+        """
+
+        file = open(self.path, "rb")
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = file.read(min(block_size or remaining, remaining))
+            if not block:
+                break
+            yield block
+            remaining -= len(block)
+        file.close()
+
+
+# The input files of a job, laid end to end
+# Every byte is addressed by its offset in the whole input, so a split is a single (offset, length) range whichever files it covers
+# Small files end up packed into the same split, large ones are divided between several
+class InputSet(object):
+
+    def __init__(self, paths):
+
+        """
+        Constructor to lay the files out
+
+        Input -
+        paths: list of the paths of the input files, in order
+        """
+
+        self.files = []
+        self.starts = []
+        self.size = 0
+
+        for path in paths:
+            for input_file in open_input(path):
+                self.files.append(input_file)
+                self.starts.append(self.size)
+                self.size += input_file.size
+
+
+    def find_split_point(self, offset):
+
+        """
+        Function to find a valid split point at or after the given offset of the whole input
+        The end of every file is a valid split point as well
+
+        Input -
+        offset: the offset the split would ideally happen at
+
+        Output -
+        The offset at which the next split starts, or the size of the input if none is left
+        """
+
+        for (input_file, start) in zip(self.files, self.starts):
+            if offset < start + input_file.size:
+                return start + input_file.find_split_point(max(offset - start, 0))
+
+        return self.size
+
+
+    def read_blocks(self, offset, length, block_size):
+
+        """
+        Generator to read a range of the whole input, one block at a time
+        The files the range covers are separated by FILE_SEPARATOR
+
+        Inputs -
+        offset, length: the range to read
+        block_size: number of bytes read at a time, every file is read at once if None
+
+        Output -
+        Generator of the blocks read
+        """
+
+        first = True
+        for (input_file, start) in zip(self.files, self.starts):
+
+            # Only read the part of the file within the range
+            file_start = max(offset, start) - start
+            file_end = min(offset + length, start + input_file.size) - start
+            if file_start >= file_end:
+                continue
+
+            if not first:
+                yield FILE_SEPARATOR
+            first = False
+
+            for block in input_file.read_blocks(file_start, file_end, block_size):
+                yield block
+
+
+    def read(self, offset, length):
+
+        """
+        Function to read a range of the whole input
+
+        Inputs -
+        offset, length: the range to read
+
+        Output -
+        The bytes read
+        """
+
+        return b"".join(self.read_blocks(offset, length, None))
+
+
+def decompress_members(path, offset, new_decompressor, magic):
+
+    """
+    Generator to decompress a file made of one or more concatenated members (gzip members, bz2 streams), starting at a member
+    Files compressed in parallel (pigz --independent, bgzip, pbzip2) hold many members, every one of them is a seek point
+
+    Inputs -
+    path: path of the file
+    offset: the offset of the member to start at, in the compressed file
+    new_decompressor: function creating a fresh decompressor
+    magic: the magic number every member starts with - anything else after a member is taken as trailing padding
+
+    Output -
+    Generator of (member_offset, data) tuples - member_offset is the offset of a member in the compressed file as it starts, with no data, and None otherwise
+    """
+
+    file = open(path, "rb")
+    file.seek(offset)
+    decompressor = None
+    block = b""
+
+    try:
+        while True:
+
+            if not block:
+                block = file.read(COMPRESSED_BLOCK_SIZE)
+                if not block:
+                    break
+
+            # A new member starts
+            if decompressor is None:
+                if len(block) < len(magic):
+                    block += file.read(len(magic))
+                if not block.startswith(magic):
+                    return
+                decompressor = new_decompressor()
+                yield offset, b""
+
+            try:
+                data = decompressor.decompress(block)
+                unused = decompressor.unused_data
+            except EOFError:
+                # Python 2 bz2 - the member ended right at the end of the previous block
+                data, unused = b"", block
+
+            # The member is over once the decompressor leaves data unused
+            ended = bool(unused) or getattr(decompressor, "eof", False)
+            offset += len(block) - len(unused)
+            block = unused
+
+            if data:
+                yield None, data
+            if ended:
+                decompressor = None
+
+        # Only the Python 3 decompressors tell whether the last member was complete
+        if not(decompressor is None or getattr(decompressor, "eof", True)):
+            raise IOError("Truncated compressed input: " + path)
+
+    finally:
+        file.close()
+
+
+# A compressed input file, decompressed as it is read
+# The decompressed size, seek points and split points are found by decompressing the file once, and cached in an index next to the map output cache
+# A file with a single member can only be decompressed from its start - every split of it skips over what comes before, without writing anything out
+class CompressedInputFile(object):
+
+    # Magic number and decompressor of the format, set by the subclasses
+    magic = None
+    new_decompressor = None
+
+    def __init__(self, path, name = None):
+
+        """
+        Constructor to initialize the file, its index is read or built straight away since the decompressed size is needed
+
+        Inputs -
+        path: path of the file
+        name: name of the member of the archive, None for a file that is not an archive
+        """
+
+        self.path = path
+        self.name = name
+        self.index = None
+
+        # Decompressed stream the last read left off in - a read starting after it carries on from there
+        self.stream = None
+        self.buffer = b""
+        self.position = 0
+
+        self.size = self.load_index()["size"]
+
+
+    def decompress(self, offset):
+
+        """
+        Generator to decompress the file from a seek point
+
+        Input -
+        offset: the offset of the seek point in the compressed file
+
+        Output -
+        Generator of (member_offset, data) tuples, as given by decompress_members()
+        """
+
+        return decompress_members(self.path, offset, type(self).new_decompressor, self.magic)
+
+
+    def load_index(self):
+
+        """
+        Function to read the index of the file off the cache, building and caching it if it is not there
+        The index is named after the path, size and modification time of the file, so changing the file makes a new one
+
+        Output -
+        Dictionary holding the decompressed size, the seek points ([decompressed offset, compressed offset] pairs) and split points of the file
+        """
+
+        if not(self.index is None):
+            return self.index
+
+        description = [os.path.abspath(self.path), self.name, os.path.getsize(self.path), os.path.getmtime(self.path)]
+        digest = hashlib.sha1(json.dumps(description).encode("utf-8")).hexdigest()
+        index_name = fileNameRetriever.get_input_index_filename(digest)
+
+        if os.path.exists(index_name):
+            index_file = open(index_name, "r")
+            self.index = json.load(index_file)
+            index_file.close()
+            return self.index
+
+        self.index = self.build_index()
+
+        # Write the index aside and rename it into place, several workers may be building it at once
+        if not(os.path.isdir(os.path.dirname(index_name))):
+            try:
+                os.makedirs(os.path.dirname(index_name))
+            except OSError:
+                # Another worker created it meanwhile
+                pass
+
+        attempt_name = fileNameRetriever.get_attempt_filename(index_name)
+        index_file = open(attempt_name, "w+")
+        json.dump(self.index, index_file)
+        index_file.close()
+        os.rename(attempt_name, index_name)
+
+        return self.index
+
+
+    def build_index(self):
+
+        """
+        Function to decompress the whole file once, recording
+        - a seek point at the start of a member every SEEK_POINT_SPACING decompressed bytes at least
+        - a split point right after the first whitespace character every SPLIT_POINT_SPACING decompressed bytes
+
+        Output -
+        Dictionary holding the decompressed size, the seek points and the split points of the file
+        """
+
+        seek_points = []
+        split_points = []
+        position = 0
+        next_split = SPLIT_POINT_SPACING
+
+        for (member_offset, data) in self.decompress(0):
+
+            if not(member_offset is None):
+                if not seek_points or position >= seek_points[-1][0] + SEEK_POINT_SPACING:
+                    seek_points.append([position, member_offset])
+                continue
+
+            # The whitespace following a split point may only turn up in a later block
+            while next_split < position + len(data):
+                match = WHITESPACE.search(data, max(next_split - position, 0))
+                if match is None:
+                    break
+                split_points.append(position + match.end())
+                next_split = position + match.end() + SPLIT_POINT_SPACING
+
+            position += len(data)
+
+        return {"size": position, "seek_points": seek_points or [[0, 0]], "split_points": split_points}
+
+
+    def find_split_point(self, offset):
+
+        """
+        Function to find the first split point recorded after the given offset
+
+        Input -
+        offset: the decompressed offset the split would ideally happen at
+
+        Output -
+        The decompressed offset at which the next split starts, or the size of the file if no split point is left
+        """
+
+        split_points = self.load_index()["split_points"]
+        split_index = bisect.bisect_right(split_points, offset)
+
+        if split_index == len(split_points):
+            return self.size
+
+        return split_points[split_index]
+
+
+    def seek_points(self):
+
+        """
+        Function to list the seek points of the file
+
+        Output -
+        List of [decompressed offset, compressed offset] pairs, in order
+        """
+
+        return self.load_index()["seek_points"]
+
+
+    def seek(self, start):
+
+        """
+        Function to position the decompressed stream at an offset
+        The stream carries on from the previous read if that is closer than any seek point, so reading the file in order only decompresses it once
+
+        Input -
+        start: the decompressed offset to position the stream at
+        """
+
+        seek_points = self.seek_points()
+        (point_position, point_offset) = seek_points[bisect.bisect_right([point[0] for point in seek_points], start) - 1]
+
+        if self.stream is None or not(point_position <= self.position <= start):
+            self.stream = (data for (member_offset, data) in self.decompress(point_offset) if data)
+            self.buffer = b""
+            self.position = point_position
+
+        # Skip over whatever comes before the offset
+        while self.position < start:
+            if not self.buffer:
+                self.buffer = next(self.stream, b"")
+                if not self.buffer:
+                    break
+            skipped = min(len(self.buffer), start - self.position)
+            self.buffer = self.buffer[skipped:]
+            self.position += skipped
+
+
+    def read_blocks(self, start, end, block_size):
+
+        """
+        Generator to read a decompressed byte range of the file, one block at a time
+
+        Inputs -
+        start, end: the byte range [start, end) to read
+        block_size: largest number of bytes in a block, blocks are as large as they decompress to if None
+
+        Output -
+        Generator of the blocks read
+        """
+
+        self.seek(start)
+
+        while self.position < end:
+            if not self.buffer:
+                self.buffer = next(self.stream, b"")
+                if not self.buffer:
+                    break
+
+            block = self.buffer[:min(block_size or len(self.buffer), end - self.position)]
+            self.buffer = self.buffer[len(block):]
+            self.position += len(block)
+            yield block
+
+
+# A gzip file, possibly made of several members
+class GzipInputFile(CompressedInputFile):
+    magic = GZIP_MAGIC
+    new_decompressor = staticmethod(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+
+# A bz2 file, possibly made of several streams
+class Bz2InputFile(CompressedInputFile):
+    magic = BZ2_MAGIC
+    new_decompressor = staticmethod(bz2.BZ2Decompressor)
+
+
+# A member of a zip archive - every member is an input of its own, so an archive of many files splits like a directory would
+# The decompressed size is read off the archive, the member is only decompressed once its split points are needed
+class ZipMemberInputFile(CompressedInputFile):
+
+    def __init__(self, path, info):
+
+        """
+        Constructor to initialize the member
+
+        Inputs -
+        path: path of the archive
+        info: the ZipInfo of the member
+        """
+
+        self.path = path
+        self.name = info.filename
+        self.index = None
+        self.stream = None
+        self.buffer = b""
+        self.position = 0
+        self.size = info.file_size
+
+
+    def decompress(self, offset):
+
+        """
+        Generator to decompress the member, which can only be done from its start
+
+        Input -
+        offset: the offset of the seek point, always 0
+
+        Output -
+        Generator of (member_offset, data) tuples, as given by decompress_members()
+        """
+
+        archive = zipfile.ZipFile(self.path)
+        member = archive.open(self.name)
+
+        try:
+            yield 0, b""
+            while True:
+                data = member.read(COMPRESSED_BLOCK_SIZE)
+                if not data:
+                    break
+                yield None, data
+
+        finally:
+            member.close()
+            archive.close()
+
+
+    def seek_points(self):
+
+        # The start of the member is its only seek point, there is no need to build the index for it
+        return [[0, 0]]
+
+
+# Input file classes of the compressed formats, by extension
+COMPRESSED_EXTENSIONS = {
+    ".gz": GzipInputFile,
+    ".bz2": Bz2InputFile,
+}
+
+
+def open_input(path):
+
+    """
+    Function to open an input file for reading, decompressing it as it is read if its extension is that of a compressed format
+
+    Input -
+    path: path of the file
+
+    Output -
+    List of the inputs the file holds - one per member of a zip archive, the file itself otherwise
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".zip":
+        archive = zipfile.ZipFile(path)
+        members = [ZipMemberInputFile(path, info) for info in archive.infolist() if not info.filename.endswith("/")]
+        archive.close()
+        return members
+
+    if extension in COMPRESSED_EXTENSIONS:
+        return [COMPRESSED_EXTENSIONS[extension](path)]
+
+    return [InputFile(path)]
@@ -0,0 +1,215 @@
+# Job manifest - records how the input was split and which tasks have completed, so that a job can be resumed
+import fcntl
+import json
+import os
+
+import fileNameRetriever
+
+
+# Class handling the manifest file of a job
+# The manifest is a small JSON file, every update to it is made under an exclusive lock and renamed into place
+class JobManifest(object):
+
+    def __init__(self, filename, input_paths, num_of_mappers, num_of_reducers):
+
+        """
+        Constructor to initialize the manifest of a job
+
+        Inputs -
+        filename: path of the manifest file
+        input_paths: list of the paths of the input files of the job
+        num_of_mappers, num_of_reducers: number of map and reduce tasks of the job, as given to the current process
+        A reduce-only run may be given fewer reducers than the job has, the number the map outputs are partitioned for is the one recorded
+        """
+
+        self.filename = filename
+        self.input_paths = input_paths
+        self.num_of_mappers = num_of_mappers
+        self.num_of_reducers = num_of_reducers
+
+
+    def read(self):
+
+        """
+        Function to read the manifest
+
+        Output -
+        Dictionary holding the manifest, or None if there is no manifest
+        """
+
+        if not(os.path.exists(self.filename)):
+            return None
+
+        manifest_file = open(self.filename, "r")
+        contents = json.load(manifest_file)
+        manifest_file.close()
+
+        return contents
+
+
+    def write(self, contents):
+
+        """
+        Function to replace the manifest atomically, so that readers never see a half written file
+
+        Input -
+        contents: Dictionary holding the manifest
+        """
+
+        attempt_name = fileNameRetriever.get_attempt_filename(self.filename)
+        manifest_file = open(attempt_name, "w+")
+        json.dump(contents, manifest_file)
+        manifest_file.close()
+        os.rename(attempt_name, self.filename)
+
+
+    def describe_input(self):
+
+        """
+        Function to describe the input files and the number of splits - the splits recorded only apply to the same description
+
+        Output -
+        Dictionary describing the split input
+        """
+
+        # Every file is described by its path, size and modification time - adding, removing or changing any of them invalidates the splits
+        return {
+            "input": [[os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)] for path in self.input_paths],
+            "num_of_mappers": self.num_of_mappers,
+        }
+
+
+    def matches(self):
+
+        """
+        Function to check whether the manifest describes the splits of the current input, left unchanged since it was split
+
+        Output -
+        Boolean True/False signifying whether the recorded splits apply
+        """
+
+        contents = self.read()
+        if contents is None:
+            return False
+
+        description = self.describe_input()
+        return all(contents.get(field) == description[field] for field in description)
+
+
+    def create(self, splits, codec = None):
+
+        """
+        Function to start a new manifest for a freshly split input, with no tasks completed
+        To be called with the lock held
+
+        Inputs -
+        splits: list of the (offset, length) ranges of the splits
+        codec: the codec the files of the job are compressed with
+        """
+
+        contents = self.describe_input()
+        contents["num_of_reducers"] = self.num_of_reducers
+        contents["splits"] = splits
+        contents["codec"] = codec
+        contents["completed"] = {"map": [], "reduce": []}
+
+        self.write(contents)
+
+
+    def completed(self, phase):
+
+        """
+        Function to read the tasks of a phase recorded as completed
+        Input -
+        phase: 'map' or 'reduce'
+
+        Output -
+        Set of the completed task IDs
+        """
+
+        contents = self.read()
+        if contents is None:
+            return set()
+
+        return set(contents["completed"][phase])
+
+
+    def mark_completed(self, phase, task_ids):
+
+        """
+        Function to record tasks of a phase as completed
+
+        Inputs -
+        phase: 'map' or 'reduce'
+        task_ids: iterable of the completed task IDs
+        """
+
+        with self.lock():
+            contents = self.read()
+            if contents is None:
+                return
+
+            contents["completed"][phase] = sorted(set(contents["completed"][phase]) | set(task_ids))
+            self.write(contents)
+
+
+    def recorded_reducers(self):
+
+        """
+        Function to read the number of reducers the map outputs of the job are partitioned for
+
+        Output -
+        The number of reducers, or None if there is no manifest
+        """
+
+        contents = self.read()
+        if contents is None:
+            return None
+
+        return contents["num_of_reducers"]
+
+
+    def repartition(self, num_of_reducers):
+
+        """
+        Function to record the number of reducers the map outputs are to be partitioned for, as the map phase starts
+        The map and reduce outputs of another number of reducers do not apply, so no task counts as completed anymore if it changed
+
+        Input -
+        num_of_reducers: number of reducers of the job
+        """
+
+        with self.lock():
+            contents = self.read()
+            if contents is None or contents["num_of_reducers"] == num_of_reducers:
+                return
+
+            contents["num_of_reducers"] = num_of_reducers
+            contents["completed"] = {"map": [], "reduce": []}
+            self.write(contents)
+
+
+    def remove(self):
+
+        """
+        Function to delete the manifest once the job is done, the next run then starts from scratch
+        """
+
+        for filename in [self.filename, self.filename + ".lock"]:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+
+    def lock(self):
+
+        """
+        Function to take an exclusive lock on the manifest, held until the returned object is closed
+        Several processes and nodes may split the input or record their tasks at once
+
+        Output -
+        The open lock file, to be used in a with statement
+        """
+
+        lock_file = open(self.filename + ".lock", "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
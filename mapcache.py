@@ -0,0 +1,169 @@
+# Map output cache - keeps the map outputs of every split, so that re-running a job only maps the splits that changed
+import hashlib
+import marshal
+import os
+import shutil
+import types
+
+import fileNameRetriever
+
+
+def code_digest(job_class, base_class):
+
+    """
+    Function to hash the code of a job, so that cached map outputs are dropped as soon as the job changes
+    Every method defined by the job class and its parents up to base_class counts, helpers defined outside the class do not
+
+    Inputs -
+    job_class: the class of the job
+    base_class: the class the job derives from, its own methods are left out
+
+    Output -
+    Hex digest of the code
+    """
+
+    digest = hashlib.sha1()
+    for cls in job_class.__mro__:
+        if cls is base_class:
+            break
+        for name, member in sorted(vars(cls).items()):
+            if isinstance(member, types.FunctionType):
+                digest.update(name.encode("utf-8"))
+                digest.update(marshal.dumps(member.__code__))
+
+    return digest.hexdigest()
+
+
+# Cache of the map outputs, one entry per split content and job
+# Every entry is a directory holding the files written by a map task, it is put in place with a single rename so it is always whole
+# The cache is bounded in size, the least recently used entries are evicted first
+class MapCache(object):
+
+    def __init__(self, cache_dir, max_size):
+
+        """
+        Constructor to initialize the cache
+
+        Inputs -
+        cache_dir: directory holding the cache entries, created if needed
+        max_size: number of bytes the entries may take up in all
+        """
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        if not(os.path.isdir(cache_dir)):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Another worker created it meanwhile
+                pass
+
+
+    def fetch(self, digest, files):
+
+        """
+        Function to put the files of a cache entry in place
+        The files are hard linked where possible, so a hit costs no copying
+
+        Inputs -
+        digest: key of the entry
+        files: dictionary of the names of the files in the entry and the path each is to be put at
+
+        Output -
+        Boolean True/False signifying whether the entry was found
+        """
+
+        entry = fileNameRetriever.get_cache_entry(digest, self.cache_dir)
+        if not(os.path.isdir(entry)):
+            return False
+
+        # The entry is evicted by another worker meanwhile - the split simply gets mapped again
+        try:
+            for name in os.listdir(entry):
+                if name in files:
+                    self.place(os.path.join(entry, name), files[name])
+
+            # Mark the entry as recently used
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return False
+
+        return True
+
+
+    def store(self, digest, files):
+
+        """
+        Function to add the files written by a map task to the cache, then evict entries until the cache fits in its size again
+
+        Inputs -
+        digest: key of the entry
+        files: dictionary of the names of the files in the entry and the path each is currently at, missing files are left out
+        """
+
+        entry = fileNameRetriever.get_cache_entry(digest, self.cache_dir)
+        if os.path.isdir(entry):
+            return
+
+        # Fill the entry aside and rename it into place
+        attempt_entry = fileNameRetriever.get_attempt_filename(entry)
+        os.makedirs(attempt_entry)
+        for name in files:
+            if os.path.exists(files[name]):
+                self.place(files[name], os.path.join(attempt_entry, name))
+
+        try:
+            os.rename(attempt_entry, entry)
+        except OSError:
+            # Another attempt stored the same entry first
+            shutil.rmtree(attempt_entry, ignore_errors=True)
+
+        self.evict()
+
+
+    def evict(self):
+
+        """
+        Function to delete the least recently used entries until the cache fits in max_size
+        """
+
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+
+            # Entries still being filled are left alone
+            if "." in name or not(os.path.isdir(entry)):
+                continue
+
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, filename)) for filename in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total_size += size
+
+        for (last_used, size, entry) in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+
+    def place(self, source, target):
+
+        """
+        Function to hard link a file to a new path, or copy it if it cannot be linked, replacing whatever is at the target
+
+        Inputs -
+        source: the existing file
+        target: the path to put it at
+        """
+
+        attempt_target = fileNameRetriever.get_attempt_filename(target)
+        try:
+            os.link(source, attempt_target)
+        except OSError:
+            shutil.copyfile(source, attempt_target)
+        os.rename(attempt_target, target)
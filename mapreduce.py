@@ -1,26 +1,99 @@
 # Single-threaded (serial) implementation with support for distribution
+from __future__ import print_function
 import fileNameRetriever
+import serializers
+import partitioners
+import shuffle
+import manifest
+import inputs
+import mapcache
+import compression
+import metrics
+import profiling
 from operator import itemgetter as o
-from multiprocessing import Process
+from itertools import groupby, chain
+import multiprocessing
 import os
+import sys
+import heapq
+import time
+import traceback
+import glob
 import json
+import hashlib
+from io import BytesIO
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Worker processes are forked, so that the job and the functions it runs on the workers never need to be pickled
+try:
+    WORKERS = multiprocessing.get_context("fork")
+except AttributeError:
+    # Python 2 always forks
+    WORKERS = multiprocessing
+
+# Number of bytes copied at a time while splitting
+BLOCK_SIZE = 1 << 20
+
+# Approximate number of bytes of mapper output buffered in memory before it is spilled to disk
+MAP_BUFFER_SIZE = 64 << 20
+
+# Approximate overhead of a buffered key-value pair on top of the key and value themselves
+RECORD_OVERHEAD = 64
+
+# Number and size (in bytes) of the blocks of input sampled to build a range partitioner
+SAMPLE_COUNT = 32
+SAMPLE_SIZE = 64 << 10
+
+# Number of records a mapper sees before it starts marking keys as hot
+HOT_KEY_WARM_UP = 1000
+
+# Index of the extra chunk holding the final results of the hot keys
+HOT_CHUNK = 'hot'
+
+# Number of times a failing task is run before it is given up on
+MAX_TASK_ATTEMPTS = 3
+
+# Number of seconds between two checks on the worker processes, while waiting on the results of their tasks
+WORKER_POLL_INTERVAL = 1
+
+# Options a job may be run with from the command line, and the attribute of the job each turns on
+JOB_OPTIONS = {
+    'metrics': 'collect_metrics',
+    'profile': 'profile',
+    'allocations': 'trace_allocations',
+}
+
+# Number of bytes the map output cache may take up
+MAP_CACHE_SIZE = 1 << 30
 
 
 # This class handles file operations - These include splitting and joining files for mapping and reducing respectively
 class FileOps(object):
     
-    def __init__(self, input_path='input', output_path='output'):
+    def __init__(self, input_paths=None, output_path='output', block_size=BLOCK_SIZE, serializer=None, codec=None):
         
         """
-        Constructor to initialize input and output directories.
-        These have been currently hardcoded, therefore: 
-        - They need to be on the same level as the current mapreduce.py file
-        - They need to be called 'input' and 'output' respectively
+        Constructor to initialize input files and output directory.
+        The input files are read in place and laid end to end, as a single input - the primary input file (input/file.ext) by default
+        The output directory is currently hardcoded, therefore: 
+        - It needs to be on the same level as the current mapreduce.py file
+        - It needs to be called 'output'
+        The serializer is used to read the reducer outputs, the length-prefixed marshal format is the default
+        The codec is the one the reducer outputs are compressed with, None if they are not
         """
 
-        # oth the input and output paths are hardcoded to 'input' and 'output'
-        self.input_file_path = input_path
+        # The output path is hardcoded to 'output'
+        self.input_paths = input_paths or [fileNameRetriever.get_filename()]
+        self.inputs = inputs.InputSet(self.input_paths)
         self.output_dir = output_path
+        self.block_size = block_size
+        self.serializer = serializer or serializers.get_serializer()
+        self.codec = codec
 
     
     def create_indexed_file(self, file_split_point, index):
@@ -36,151 +109,474 @@ class FileOps(object):
         - split: This is the split file created from the given split point and created with the given index
         """
 
-        # open the file at the given split point
-        split = open(fileNameRetriever.get_split_filename(file_split_point-1), "w+")
+        # open the file at the given split point - binary, since chunks are copied over as raw blocks
+        split = open(fileNameRetriever.get_split_filename(file_split_point-1), "wb+")
 
         # write new file with the index in the beginning of the file
-        split.write(str(index) + "\n")
+        split.write((str(index) + "\n").encode("ascii"))
 
         return split
 
 
-    def validate_split(self, check_char, split_index, size, split_number):
+    def compute_split_ranges(self, num_chunks, chunk_size=None):
 
         """
-        Function to check if the split is happening in the right place, i.e: 
-        - The split cannot be in the middle of a string/number
-        - The split has to happen according to the split_index specified
-
-        Inputs - 
-        check_char: the character on which the split index falls
-        split_index: the point at which the file is to be split
-        size: The number of characters in each split. The splits are largely equal 
-        split_number: The number of the current split - for example if there are 4 splits, this number can be between 0-3
+        Function to compute the byte ranges of every split, without copying any of the input
 
-        Outputs - 
-        Boolean True/False signifying whether the split is correct or not
+        Input:
+        num_chunks: Number of ranges to split the current file into
+        chunk_size: Size every split starts out from, the input is divided evenly between the splits if None
 
+        Output:
+        ranges: List of (offset, length) tuples, one per split, covering the whole input
         """
 
-        # check if the split is happening at the right index and check if the index is on a space character
-        if split_index > size*split_number+1 and check_char.isspace():
-            return True
-        else:
-            return False
+        # Get input and unit size size - unit size is needed for finding the split points
+        original_size = self.inputs.size
+        chunk_size = chunk_size or (original_size // num_chunks) + 1
+
+        # Each split starts where the previous one ended - split points never go backwards
+        # A split may run across several small files, or take up only part of a large one
+        ranges = []
+        chunk_start = 0
+        for chunk_index in range(1, num_chunks + 1):
+
+            # The final split always runs to the end of the file
+            if chunk_index == num_chunks:
+                chunk_end = original_size
+            else:
+                chunk_end = self.inputs.find_split_point(max(chunk_size * chunk_index, chunk_start))
+
+            ranges.append((chunk_start, chunk_end - chunk_start))
+            chunk_start = chunk_end
 
+        return ranges
 
-    def split_controller(self, num_chunks):
+
+    def split_controller(self, num_chunks, virtual=False, chunk_size=None):
 
         """
-        Master function to carry out the file split by invoking the create_indexed_file() and check_split() methods
+        Master function to carry out the file split by invoking the compute_split_ranges() and create_indexed_file() methods
+        The input is copied over one block at a time, so only the blocks being copied are ever held in memory
 
         Input:
         nums_split: Number of files to split the current file into. This is set to the number of mappers specified by the user
+        virtual: When True, only the table of split ranges is written and the mappers read their range off the input file directly
+        chunk_size: Size every split starts out from, the file is divided evenly between the splits if None
+
+        Output:
+        ranges: List of the (offset, length) ranges of the splits
         """
-        
-        # Get file and unit size size - unit size is needed for checking the split validity
-        original_size = os.path.getsize(self.input_file_path)
-        chunk_size = (original_size / num_chunks) + 1
 
-        # Read the file contents and store in memory
-        file = open(self.input_file_path, "r")
-        original_content = file.read()
-        file.close()
+        ranges = self.compute_split_ranges(num_chunks, chunk_size)
 
-        # Initialize index and current split - both needed for checking split validity
-        # (index, current_split_index) = (1, 1)
-        intended_index = 1
-        chunk_index = 1
+        # Virtual splits - record the ranges, nothing is copied
+        # Several workers may split the same input at once, so the table is written aside and renamed into place
+        if virtual:
+            split_table_name = fileNameRetriever.get_split_table_filename(self.output_dir)
+            split_table = open(fileNameRetriever.get_attempt_filename(split_table_name), "w+")
+            json.dump(ranges, split_table)
+            split_table.close()
+            os.rename(fileNameRetriever.get_attempt_filename(split_table_name), split_table_name)
+            return ranges
 
-        # initialize the split at the required index
-        chunk = self.create_indexed_file(1,1)
+        for chunk_index, (chunk_start, chunk_length) in enumerate(ranges, 1):
 
-        # Create the split
-        # Traverse the file contents character by character 
-        # (TODO - This is not ideal)
-        for token in original_content:
+            # Create the indexed file and copy the byte range over
+            chunk = self.create_indexed_file(chunk_index, chunk_start)
+            for block in self.inputs.read_blocks(chunk_start, chunk_length, self.block_size):
+                chunk.write(block)
+            chunk.close()
 
-            chunk.write(token)
+        return ranges
 
-            # Check if the split can happen after the current character
-            if self.validate_split(token, intended_index, chunk_size, chunk_index):
 
-                #Split can happen - Create the indexed file here and close
-                chunk.close()
-                chunk_index += 1
-                chunk = self.create_indexed_file(chunk_index, intended_index)
+    def read_samples(self, num_samples, sample_size):
 
-            #Split cannot happen - move onto the next index
-            intended_index += 1
-        
-        # File has been split, close the created file
-        chunk.close()
+        """
+        Function to read evenly spaced blocks of the input, each starting and ending on whitespace
+
+        Inputs - 
+        num_samples: Number of blocks to read
+        sample_size: Approximate size of every block, in bytes
+
+        Output - 
+        samples: List of the blocks read
+        """
+
+        # An empty input has nothing to sample
+        original_size = self.inputs.size
+        if original_size == 0:
+            return []
+
+        samples = []
+        for sample_num in range(num_samples):
+
+            # Move the start of the block forward to the next whitespace, so that no word is cut in half
+            sample_start = (original_size * sample_num) // num_samples
+            if sample_start:
+                sample_start = self.inputs.find_split_point(sample_start)
+
+            sample_end = self.inputs.find_split_point(min(sample_start + sample_size, original_size))
+            samples.append(self.inputs.read(sample_start, sample_end - sample_start))
+
+        return samples
+
+
+    def read_split(self, index):
+
+        """
+        Function to read a virtual split straight off the input files, using the table written by split_controller()
+
+        Input - 
+        index: The index of the split to be read
+
+        Output - 
+        key, value: The offset of the split and its contents
+        """
+
+        # Look up the byte range of the split
+        split_table = open(fileNameRetriever.get_split_table_filename(self.output_dir), "r")
+        offset, length = json.load(split_table)[index]
+        split_table.close()
+
+        # Read only the required range of the input files
+        return str(offset), self.inputs.read(offset, length)
         
 
-    def consolidate_chunks(self, num_chunks):
+    def read_chunk(self, chunk_number):
+
+        """
+        Generator to read the output of a single reducer one record at a time
+
+        Input - 
+        chunk_number: Number of the chunk to read
+
+        Output - 
+        Generator of the records of the chunk, in the order the reducer wrote them
+        """
+
+        # open chunk
+        f = compression.reader(open(fileNameRetriever.get_reduce_filename(chunk_number, output_dir=self.output_dir, codec=self.codec), "rb"), self.codec)
+        for record in self.serializer.load(f):
+            yield record
+        f.close()
+
+
+    def consolidate_chunks(self, num_chunks, top_k=None, full_output=True):
         
         """
-        Function to consolidate all the output chunks into a single file
+        Function to consolidate all the output chunks into a single file, in order of key
+        Every reducer writes its chunk sorted by key already, so the chunks are merged as they are read and the output is written incrementally
+        The top_k records, by count, are kept on a bounded heap as they go by
+        If full_output is turned off, only the top_k records are written out
 
         Input - 
         num_chunks: Number of chunks to consolidate
+        top_k: Number of records to return, all of them if None. Required when full_output is turned off
+        full_output: Boolean flag to signify whether all the records, or only the top_k ones, are written to the output file
         
         Output - 
-        final_list: Sorted list containing all words and their counts
+        final_list: List containing the top_k (or all) words and their counts, in descending order of count
         """
 
-        # Initialize list that holds the final output
-        final_list = []
+        # The results of the hot keys, if any were split across reducers, make up one more chunk
+        chunk_numbers = list(range(num_chunks))
+        if os.path.exists(fileNameRetriever.get_reduce_filename(HOT_CHUNK, output_dir=self.output_dir, codec=self.codec)):
+            chunk_numbers.append(HOT_CHUNK)
 
-        # Traverse through bunch of chunks
-        for chunk_number in range(0, num_chunks):
+        # Top-K query - keep only the K largest counts in memory, whatever the size of the chunks
+        if not full_output:
+            final_list = heapq.nlargest(top_k, chain(*[self.read_chunk(chunk_number) for chunk_number in chunk_numbers]), key=o(1))
+            records = final_list
 
-            # open chunk
-            f = open(fileNameRetriever.get_reduce_filename(chunk_number), "r")
-
-            # append to list and close
-            final_list += json.load(f)
-            f.close()
+        # Full output - merge the sorted chunks, keeping the top_k records to return
+        else:
+            largest = []
+            records = self.collect_largest(self.merge_chunks([self.read_chunk(chunk_number) for chunk_number in chunk_numbers]), largest, top_k)
 
-            # Remove chunks once done
-            os.unlink(fileNameRetriever.get_reduce_filename(chunk_number))
+        # Create a final output file to store the result - it is private to the current attempt until it is complete
+        # A failed join leaves neither a partial output file nor a missing chunk behind, and can be run again
+        output_filename = fileNameRetriever.get_output_filename(self.output_dir)
+        output_join_file = open(fileNameRetriever.get_attempt_filename(output_filename), "wb+")
 
-        # Sort the final list in descending order of maximum count
-        final_list.sort(key=o(1), reverse=True)
+        # Populate file with the records one at a time
+        try:
+            serializers.JSONSerializer().dump(records, output_join_file)
+        except Exception:
+            output_join_file.close()
+            os.unlink(fileNameRetriever.get_attempt_filename(output_filename))
+            raise
+        output_join_file.close()
+        os.rename(fileNameRetriever.get_attempt_filename(output_filename), output_filename)
 
-        # Create a final output file to store the result 
-        output_join_file = open(fileNameRetriever.get_output_filename(self.output_dir), "w+")
+        # Remove chunks once done
+        for chunk_number in chunk_numbers:
+            os.unlink(fileNameRetriever.get_reduce_filename(chunk_number, output_dir=self.output_dir, codec=self.codec))
 
-        # Populate file with the list we've created
-        json.dump(final_list, output_join_file)
-        output_join_file.close()
+        if full_output:
+            final_list = [record for (count, position, record) in sorted(largest, reverse=True)]
 
         # Return list contents, used later to print to stdout
         return final_list
-    
+
+
+    def merge_chunks(self, chunks):
+
+        """
+        Function to merge chunks sorted by key into a single stream sorted by key
+        Invoked by consolidate_chunks()
+
+        Input - 
+        chunks: list of iterables of records, each sorted by key
+
+        Output - 
+        Iterable of the records of all the chunks, sorted by key
+        """
+
+        # heapq.merge only takes a key function from Python 3.5 - before that, every record is decorated with its key
+        try:
+            return heapq.merge(*chunks, key=o(0))
+        except TypeError:
+            decorated = [self.decorate_chunk(chunk, chunk_order) for chunk_order, chunk in enumerate(chunks)]
+            return (record for (key, chunk_order, record) in heapq.merge(*decorated))
+
+
+    def decorate_chunk(self, chunk, chunk_order):
+
+        # Generator to put the key and the order of the chunk ahead of every record, so that the merge never has to compare values
+        for record in chunk:
+            yield (record[0], chunk_order, record)
+
+
+    def collect_largest(self, records, largest, count):
+
+        """
+        Generator to pass records through, while keeping the records with the largest counts on a bounded heap
+        Records with the same count are kept in the order they went by
+        Invoked by consolidate_chunks()
+
+        Inputs - 
+        records: iterable of records
+        largest: list the heap of (count, -position, record) tuples is kept in
+        count: number of records to keep, all of them if None
+        """
+
+        for position, record in enumerate(records):
+            if count is None or len(largest) < count:
+                heapq.heappush(largest, (record[1], -position, record))
+            elif record[1] > largest[0][0]:
+                heapq.heapreplace(largest, (record[1], -position, record))
+            yield record
+
 
 # Class containing the functions that implement the MapReduce system
 # The map and reduce methods are virtual and are to be overridden by any program that uses the system 
 class MapReduce(object):
 
-    def __init__(self, input_path = 'input', output_path = 'output', num_of_chunks = 4, num_of_reducers = 4):
+    def __init__(self, input_path = 'input', output_path = 'output', num_of_chunks = 4, num_of_reducers = 4, virtual_splits = True, map_buffer_size = MAP_BUFFER_SIZE, serializer = 'marshal', num_of_workers = None, partitioner = 'hash', hot_key_fanout = 1, shuffle_port = None, shuffle_hosts = None, split_size = None, map_cache = None, map_cache_size = MAP_CACHE_SIZE, codec = None, collect_metrics = False, profile = False, trace_allocations = False):
         
         """
         Constructor to initialize directories and user inputs/options
+        input_path is the primary input directory (input/file.ext), any other directory whose files are all inputs, a glob pattern or a single file
+        The input files are read in place, as a single input laid end to end - small files are packed into the same split and large ones divided
+        gzip (.gz), bz2 (.bz2) and zip (.zip) files are decompressed as they are read, the index of seek and split points of each is cached under cache/
+        With virtual_splits, only a table of byte ranges is written and each mapper reads its own range off the input files
+        Otherwise every split is copied out into its own file_N.ext first
+        map_buffer_size bounds the memory (in bytes, approximately) held by the mapper output before it is spilled to disk
+        serializer names the format of the intermediate and reducer output files - 'marshal' (default) or 'json' for debugging
+        num_of_workers is the size of the pool of worker processes running the map and reduce tasks, it defaults to the number of cores
+        The number of splits (num_of_chunks) is independent of it - many small splits balance out better across the workers
+        partitioner decides which reducer every key goes to - 'hash' (default, stable across nodes), 'range' (balanced ranges sampled off the input) or any object with a partition(key) method
+        hot_key_fanout is the number of reducers the records of every hot key are spread across - 1 (default) turns hot key detection off
+        The lists of hot keys and their partial results are read off the shared output directory, so hot keys cannot be split with a network shuffle
+        Splitting hot keys requires a combiner - a ValueError is raised otherwise - and the reducer has to accept its own outputs as values, since the partial results are reduced once more
+        shuffle_port makes a map-only run serve its intermediate files over TCP on that port, until the reducers have acknowledged them
+        shuffle_hosts is the list of host:port shuffle servers the reducers fetch from, the shared output directory is read if None
+        The splits and the completed tasks are recorded in a job manifest - the input is only split again if it changed or the number of splits did
+        split_size fixes the size of every split in bytes, the number of splits then follows from the size of the input instead of num_of_chunks
+        Appending to an input split this way leaves all but its last split unchanged
+        map_cache is the directory to cache the map outputs of every split in, so that a re-run only maps the splits whose content or mapper code changed
+        map_cache_size bounds the size of the cache in bytes, the least recently used outputs are evicted first
+        codec is the one the intermediate and reducer output files are compressed with - None (default), 'zlib', 'bz2', 'lzma' (Python 3 only)
+        or 'auto', which times the codecs on a sample of the map output and picks the one writing it out fastest, or none
+        The joined output file is never compressed
+        collect_metrics makes every process of the job write out the wall time of its phases, tasks and steps, the bytes and records its tasks read and wrote and its peak memory
+        They are merged into output/metrics.json and a Chrome trace, output/trace.json, once the outputs are joined - it may also be turned on once the job is set up
+        profile runs every map and reduce task under cProfile, trace_allocations (Python 3 only) traces the memory every line of a task allocates with tracemalloc
+        Every task dumps its own profile, those of a phase are merged into output/profile_<phase>.txt (and .prof) and output/allocations_<phase>.txt as the phase completes
+        Both may also be turned on once the job is set up
         """
 
+        if trace_allocations and profiling.tracemalloc is None:
+            raise ValueError("Tracing allocations requires tracemalloc, which only ships with Python 3")
+
         self.input_path = input_path
         self.output_path = output_path
         self.num_of_mappers = num_of_chunks
         self.num_of_reducers = num_of_reducers
-        self.fileOps = FileOps(fileNameRetriever.get_filename(self.input_path), self.output_path)
-        self.fileOps.split_controller(self.num_of_mappers)
+        self.virtual_splits = virtual_splits
+        self.map_buffer_size = map_buffer_size
+        self.serializer = serializers.get_serializer(serializer)
+        self.requested_codec = codec if codec == 'auto' else compression.get_codec(codec)
+        self.codec = None if codec == 'auto' else codec
+        self.num_of_workers = num_of_workers or multiprocessing.cpu_count()
+        self.collect_metrics = collect_metrics
+        self.profile = profile
+        self.trace_allocations = trace_allocations
+        self.profiler = None
+
+        # Spans of the job as a whole - a worker records those of its current task instead
+        self.job_recorder = metrics.Recorder()
+        self.recorder = self.job_recorder
+
+        # Input files, read in place
+        self.input_files = fileNameRetriever.get_input_files(self.input_path)
+        if not self.input_files:
+            raise IOError("No input files found at " + str(self.input_path))
+        self.fileOps = FileOps(self.input_files, self.output_path, serializer=self.serializer)
+
+        # Fixed size splits - there are as many as it takes to cover the input
+        self.split_size = split_size
+        if split_size:
+            self.num_of_mappers = max(1, (self.fileOps.inputs.size + split_size - 1) // split_size)
+
+        self.manifest = manifest.JobManifest(fileNameRetriever.get_manifest_filename(self.output_path), self.input_files,
+                                             self.num_of_mappers, self.num_of_reducers)
+        start = time.time()
+        self.prepare_splits()
+        self.recorder.record('split', start, 'phase')
+        self.fileOps.codec = self.codec
+        self.partitioner = self.build_partitioner(partitioner)
+        if hot_key_fanout > 1 and not self.has_combiner():
+            raise ValueError("Hot keys can only be split across reducers by a job with a combiner, set hot_key_fanout to 1")
+        self.hot_key_fanout = min(hot_key_fanout, self.num_of_reducers)
+        self.shuffle_port = shuffle_port
+        self.shuffle_hosts = shuffle_hosts
+        self.check_shuffle()
+
+        # The cached map outputs of a split only apply to the same mapper code and partitioning
+        self.map_cache = mapcache.MapCache(map_cache, map_cache_size) if map_cache else None
+        self.job_digest = self.compute_job_digest() if map_cache else None
+
+
+    def prepare_splits(self):
+
+        """
+        Function to split the input, unless the manifest shows it has already been split the same way
+        Reduce-only runs and resumed jobs then reuse the splits of the first run
+        The manifest is locked meanwhile, so that runs starting at the same time split the input only once
+        A codec picked automatically is recorded in the manifest along with the splits, every run of the job then uses the same one
+        Invoked by the constructor
+        """
+
+        with self.manifest.lock():
+
+            # The recorded splits are only of use if they are still on disk - the table, or the split files of the maps still to run
+            if self.manifest.matches():
+                if self.requested_codec == 'auto':
+                    self.codec = self.manifest.read().get("codec")
+
+                if self.virtual_splits:
+                    splits_present = os.path.exists(fileNameRetriever.get_split_table_filename(self.output_path))
+                else:
+                    splits_present = all(os.path.exists(fileNameRetriever.get_split_filename(i)) for i in self.pending_tasks('map', range(self.num_of_mappers)))
+
+                if splits_present:
+                    return
+
+            # Split the input and start a new manifest
+            if self.requested_codec == 'auto':
+                self.codec = self.choose_codec()
+            ranges = self.fileOps.split_controller(self.num_of_mappers, virtual=self.virtual_splits, chunk_size=self.split_size)
+            self.manifest.create(ranges, self.codec)
+
+
+    def choose_codec(self):
+
+        """
+        Function to pick the codec of the job - the mapper is run over the first block of the input, and its output is timed with every codec
+        Invoked by prepare_splits() when the codec is to be picked automatically
+
+        Output - 
+        Name of the codec writing the sample out fastest, or None if compressing does not pay off
+        """
+
+        sample = BytesIO()
+        for block in self.fileOps.read_samples(1, BLOCK_SIZE):
+            records, distinct_keys = self.map_split(None, block)
+            self.serializer.dump(self.sort_partition(list(records), not distinct_keys), sample)
+
+        codec = compression.choose_codec(sample.getvalue(), self.output_path)
+        print("Codec picked: " + str(codec))
+
+        return codec
+
+
+    def compute_job_digest(self):
+
+        """
+        Function to hash everything besides the split itself that the map outputs depend on - the code of the job, the partitioning and the file format
+        Invoked by the constructor when the map outputs are cached
+
+        Output - 
+        Hex digest of the job
+        """
+
+        digest = hashlib.sha1()
+        digest.update(mapcache.code_digest(type(self), MapReduce).encode("utf-8"))
+        digest.update(repr((self.num_of_reducers, type(self.partitioner).__name__, sorted(getattr(self.partitioner, "__dict__", {}).items()),
+                            self.hot_key_fanout, self.serializer.name, self.codec)).encode("utf-8"))
+
+        return digest.hexdigest()
+
+
+    def split_digest(self, key, value):
+
+        """
+        Function to compute the key of the cached map outputs of a split
+        Invoked by mapper_controller()
+
+        Inputs - 
+        key, value: the key and value the mapper is called with for the split
+
+        Output - 
+        Hex digest of the split and the job
+        """
+
+        digest = hashlib.sha1(self.job_digest.encode("utf-8"))
+        digest.update(partitioners.key_bytes(key))
+        digest.update(b"\n")
+        digest.update(partitioners.key_bytes(value))
+
+        return digest.hexdigest()
+
+
+    def map_output_files(self, file_index):
+
+        """
+        Function to list the files a map task writes, as kept in the map output cache
+
+        Input - 
+        file_index: number/identifier for the split being mapped
+
+        Output - 
+        Dictionary of the names of the files in a cache entry and the path of each in the output directory
+        """
+
+        files = dict((str(reducer_num) + ".ext", fileNameRetriever.get_intermediate_file(file_index, reducer_num, output_dir=self.output_path, codec=self.codec)) for reducer_num in range(self.num_of_reducers))
+        files["hot_keys.ext"] = fileNameRetriever.get_hot_keys_file(file_index, output_dir=self.output_path, codec=self.codec)
+
+        return files
 
 
     # Mapper and reducer virtual functions are given below
     # Mapper takes in information in a key and value pair - for example key is line and value is word
+    # Mapper may either return a list of key-value pairs or yield them one at a time
+    # The value is the raw bytes of the split, a mapper working on text decodes it (or only the keys it emits) itself
+    # Keys and values are shuffled as they are, bytes included, with the default marshal serializer
     # Reducer takes in the key and the index it should reduce at
+    # Reducer is handed the values of a key as an iterator, which can only be traversed once
     # Both these functions are to be overridden
 
     def mapper(self, key, value):
@@ -189,6 +585,133 @@ class MapReduce(object):
     def reducer(self, key, values):
         pass
 
+    # The combiner is optional - if overridden, it is run over each mapper partition before it is written out
+    # It takes the same inputs as the reducer and returns a single key-value pair
+    # It may be applied more than once to the same key when the mapper output is spilled, so it must accept its own outputs as values
+    def combiner(self, key, values):
+        pass
+
+    # The batch mapper is optional - if overridden, it is called instead of the mapper, with the same inputs
+    # It may return its key-value pairs pre-aggregated, as a dictionary (for example a Counter) holding one value per distinct key
+    # Its values are then partial results, so the reducer (and combiner, if any) must accept them as values
+    def batch_mapper(self, key, value):
+        pass
+
+    # The record weight is optional - it is the number of records a key-value pair of the mapper stands for, 1 by default
+    # Hot keys are found by their share of the records, so a batch mapper returning pre-aggregated counts weighs every pair by its count
+    def record_weight(self, key, value):
+        return 1
+
+
+    def has_combiner(self):
+
+        """
+        Function to check whether the job overrides the combiner
+
+        Output - 
+        Boolean True/False signifying whether the combiner is to be run
+        """
+
+        return type(self).combiner != MapReduce.combiner
+
+
+    def has_batch_mapper(self):
+
+        """
+        Function to check whether the job overrides the batch mapper
+
+        A subclass overriding the mapper of a job that has a batch mapper gets its own mapper run
+
+        Output - 
+        Boolean True/False signifying whether the batch mapper is to be run instead of the mapper
+        """
+
+        # Find the classes the mapper and the batch mapper come from
+        batch_mapper_class = [cls for cls in type(self).__mro__ if 'batch_mapper' in vars(cls)][0]
+        mapper_class = [cls for cls in type(self).__mro__ if 'mapper' in vars(cls)][0]
+
+        return batch_mapper_class is not MapReduce and issubclass(batch_mapper_class, mapper_class)
+
+
+    def map_split(self, key, value):
+
+        """
+        Function to run the batch mapper if the job defines one, or the mapper otherwise, over a split
+        Invoked by mapper_controller(), choose_codec() and run_mapper()
+
+        Inputs - 
+        key, value: the key and value the mapper is called with
+
+        Output - 
+        Tuple of the iterable of key-value pairs, and a Boolean flag set if every key is known to occur once
+        """
+
+        if not self.has_batch_mapper():
+            return self.mapper(key, value), False
+
+        # A dictionary of pre-aggregated values holds one pair per distinct key, there is nothing left to combine
+        result = self.batch_mapper(key, value)
+        if hasattr(result, 'items'):
+            return result.items(), True
+
+        return result, False
+
+
+    def run_mapper(self, key, value):
+
+        """
+        Function to run the mapper over a split, or over a sample of the input
+        Invoked wherever only the mapper output is needed
+
+        Inputs - 
+        key, value: the key and value the mapper is called with
+
+        Output - 
+        Iterable of key-value pairs
+        """
+
+        return self.map_split(key, value)[0]
+
+
+    def combine_partition(self, partition):
+
+        """
+        Function to pre-aggregate a single mapper partition with the combiner
+        Invoked by sort_partition() and merge_partition()
+
+        Input - 
+        partition: iterable of key-value pairs bound for a single reducer, sorted by key
+
+        Output - 
+        Generator of key-value pairs, one per distinct key, as returned by the combiner
+        """
+
+        # The partition is sorted, so the values of a key are next to each other
+        for key, group in groupby(partition, key=o(0)):
+            yield self.combiner(key, [value for (key, value) in group])
+
+
+    def sort_partition(self, partition, combine=True):
+
+        """
+        Function to sort a single in-memory mapper partition by key, and combine it if the job defines a combiner
+
+        Inputs - 
+        partition: list of key-value pairs bound for a single reducer
+        combine: Boolean flag to signify whether the partition may hold a key more than once, and so is to be combined
+
+        Output - 
+        List of key-value pairs sorted by key
+        """
+
+        # Sort on the key alone, the values need not be comparable
+        partition.sort(key=o(0))
+
+        if combine and self.has_combiner():
+            return list(self.combine_partition(partition))
+
+        return partition
+
 
     def validate_pos(self, key, position):
         
@@ -205,13 +728,60 @@ class MapReduce(object):
         """
 
         # Check if position is 
-        if position == (hash(key) % self.num_of_reducers):
+        if position == self.get_partition(key):
             return True
         
         else:
             return False
 
 
+    def get_partition(self, key):
+
+        """
+        Function to compute the reducer a key belongs to
+        Invoked by mapper_controller() once per record
+
+        Input - 
+        key: Key for the mapping
+
+        Output - 
+        The index of the reducer the key is to be sent to
+        """
+
+        return self.partitioner.partition(key)
+
+
+    def build_partitioner(self, partitioner):
+
+        """
+        Function to create the partitioner used by get_partition()
+        A range partitioner is built out of the keys the mapper emits over a sample of the input
+
+        Input - 
+        partitioner: name of one of the partitioners in partitioners.PARTITIONERS, or an object with a partition(key) method
+
+        Output - 
+        The partitioner to be used
+        """
+
+        # A ready-made partitioner is used as is
+        if not(partitioner in partitioners.PARTITIONERS):
+            if hasattr(partitioner, 'partition'):
+                return partitioner
+            raise ValueError("Unknown partitioner: " + str(partitioner))
+
+        if partitioner == partitioners.RangePartitioner.name:
+
+            # Run the mapper over the sampled blocks and keep the keys only
+            sampled_keys = []
+            for sample in self.fileOps.read_samples(SAMPLE_COUNT, SAMPLE_SIZE):
+                sampled_keys.extend(key for (key, value) in self.run_mapper(None, sample))
+
+            return partitioners.RangePartitioner.from_sample(self.num_of_reducers, sampled_keys)
+
+        return partitioners.PARTITIONERS[partitioner](self.num_of_reducers)
+
+
 
     def mapper_controller(self, file_index):
         
@@ -221,33 +791,211 @@ class MapReduce(object):
         Input - 
         file_index: number/identifier for the file which is being split
         """
+
+        task_start = self.start_task('map', file_index)
         
-        # Get the contents of the input file
-        input_chunk = open(fileNameRetriever.get_split_filename(file_index), "r")
+        # Virtual splits are read straight off the input file, the offset of the split is the key
+        start = time.time()
+        if self.virtual_splits:
+            key, value = self.fileOps.read_split(file_index)
 
-        # Get a single line (the index on top of the chunk) and store it as key
-        key = input_chunk.readline()
+        else:
+
+            # Get the contents of the input file - as bytes, just as the virtual splits are read
+            input_chunk = open(fileNameRetriever.get_split_filename(file_index), "rb")
+
+            # Get a single line (the index on top of the chunk) and store it as key
+            key = input_chunk.readline().decode("ascii")
+
+            # Get the entire chunk's content as the value and close the chunk file
+            # The chunk file is only deleted once the map task has completed, a failed task is run again off it
+            value = input_chunk.read()
+            input_chunk.close()
+
+        self.recorder.record('read_split', start)
+        self.recorder.count('bytes_read', len(value))
+
+        # A split mapped by an earlier run of the same job has its outputs put in place straight from the cache
+        if self.map_cache is not None:
+            start = time.time()
+            digest = self.split_digest(key, value)
+            cached = self.map_cache.fetch(digest, self.map_output_files(file_index))
+            self.recorder.record('cache_fetch', start)
+            if cached:
+                self.finish_task(task_start)
+                return
+
+        # Call the mapper - the result may be a list or a generator yielding the key-value pairs one at a time
+        # A batch mapper returns every key once, with its values aggregated over the whole split already
+        start = time.time()
+        mapper_result, distinct_keys = self.map_split(key, value)
+        if self.collect_metrics:
+            mapper_result = self.recorder.counted(mapper_result, 'records_in')
+
+        # Keys making up a large share of the records are hot, their records are spread round-robin across hot_key_fanout reducers
+        # A key is hot once it holds more than half of the share of a single reducer
+        # Every mapper starts the round-robin off at its own reducer, so that a key a batch mapper emits once per split is spread out as well
+        sketch = partitioners.HotKeySketch(4 * self.num_of_reducers, 0.5 / self.num_of_reducers, HOT_KEY_WARM_UP)
+        salt = file_index % self.hot_key_fanout
+
+        # Bucket the mapper output into all the reducer partitions in a single pass
+        # Once the buffered records outgrow the map buffer, the partitions are spilled to disk as sorted runs
+        partitions = [[] for reducer_num in range(self.num_of_reducers)]
+        buffered = 0
+        num_runs = 0
+        for (map_key, map_value) in mapper_result:
+            reducer_num = self.get_partition(map_key)
+            if self.hot_key_fanout > 1 and sketch.add(map_key, self.record_weight(map_key, map_value)):
+                salt = (salt + 1) % self.hot_key_fanout
+                reducer_num = (reducer_num + salt) % self.num_of_reducers
+            partitions[reducer_num].append((map_key, map_value))
+
+            # Estimate the memory held by the record
+            buffered += sys.getsizeof(map_key) + sys.getsizeof(map_value) + RECORD_OVERHEAD
+            if buffered > self.map_buffer_size:
+                self.spill_partitions(file_index, partitions, num_runs, not distinct_keys)
+                partitions = [[] for reducer_num in range(self.num_of_reducers)]
+                buffered = 0
+                num_runs += 1
+
+        # Mapping takes in the spills as well
+        self.recorder.record('map', start)
+
+        # Create files containing the outputs for the reducers to later work on, merging in any spilled runs
+        start = time.time()
+        for reducer_num in range(self.num_of_reducers):
+            self.merge_partition(file_index, reducer_num, partitions[reducer_num], num_runs, not distinct_keys)
+        self.recorder.record('merge', start)
+
+        # Let the reducers know which keys were split, their results only make up part of the final result
+        if sketch.hot_keys:
+            self.commit_file(fileNameRetriever.get_hot_keys_file(file_index, output_dir=self.output_path, codec=self.codec), sorted(sketch.hot_keys))
+
+        # Keep the outputs for the next run
+        if self.map_cache is not None:
+            start = time.time()
+            self.map_cache.store(digest, self.map_output_files(file_index))
+            self.recorder.record('cache_store', start)
+
+        self.finish_task(task_start)
+
+
+    def commit_file(self, filename, records):
+
+        """
+        Function to write records out atomically - they are written to a file private to the current attempt, which is then renamed into place
+        If the same task runs twice, for example as a speculative backup, the file is whole whichever attempt renames it last
+
+        Inputs - 
+        filename: the file to write
+        records: iterable of the records to write
+        """
+
+        # A failed attempt leaves nothing behind
+        attempt_file = compression.writer(open(fileNameRetriever.get_attempt_filename(filename), "wb+"), self.codec)
+        try:
+            self.serializer.dump(records, attempt_file)
+        except Exception:
+            attempt_file.close()
+            os.unlink(fileNameRetriever.get_attempt_filename(filename))
+            raise
+        attempt_file.close()
+        self.recorder.count('bytes_written', os.path.getsize(fileNameRetriever.get_attempt_filename(filename)))
+        os.rename(fileNameRetriever.get_attempt_filename(filename), filename)
 
-        # Get the entire chunk's content as the value, close and delete the chunk file
-        value = input_chunk.read()
-        input_chunk.close()
-        os.unlink(fileNameRetriever.get_split_filename(file_index))
 
-        # Call the mapper and store the result, for example the word counts into a variable
-        mapper_result = self.mapper(key, value)
+    def spill_partitions(self, file_index, partitions, run_number, combine=True):
+
+        """
+        Function to spill the buffered mapper partitions to disk as sorted runs
+        Invoked by mapper_controller() when the map buffer is full
+
+        Inputs - 
+        file_index: number/identifier for the split being mapped
+        partitions: list holding the buffered key-value pairs of every reducer
+        run_number: number of the run being spilled
+        combine: Boolean flag to signify whether the partitions are to be combined before they are spilled
+        """
 
-        # Create files containing the outputs for the reducers to later work on
         for reducer_num in range(self.num_of_reducers):
 
-            # Open a temp file
-            map_intermediate = open(fileNameRetriever.get_intermediate_file(file_index, reducer_num), "w+")
+            # Open the run file - it is private to the current attempt of the map task
+            spill_name = fileNameRetriever.get_attempt_filename(fileNameRetriever.get_spill_file(file_index, reducer_num, run_number, output_dir=self.output_path, codec=self.codec))
+            spill = compression.writer(open(spill_name, "wb+"), self.codec)
+
+            # Write the sorted records out, the run is read back one record at a time while merging
+            self.serializer.dump(self.sort_partition(partitions[reducer_num], combine), spill)
+            spill.close()
+            self.recorder.count('bytes_written', os.path.getsize(spill_name))
+
+
+    def read_run(self, filename, run_number, address=None, delete=True):
+
+        """
+        Generator to read a sorted run back one record at a time, deleting the file once it has been read
+        Invoked by merge_partition() for the spilled runs and by reducer_controller() for the intermediate files
+
+        Inputs - 
+        filename: the file holding the run
+        run_number: number identifying the run among the runs being merged
+        address: host:port of the shuffle server to fetch the file from, the file is read locally if None
+        delete: Boolean flag to signify whether a local file is deleted once it has been read
+
+        Output - 
+        Generator of (key, run_number, position, value) tuples, so that the merge never has to compare values
+        """
+
+        # Remote files are fetched in the background while the records already received are deserialized
+        # The shuffle server keeps the file until the reducer acknowledges it, once it has committed its output
+        # Only the bytes received are counted as they are read, a local file is counted all at once
+        if address is not None:
+            run = compression.reader(self.measure(shuffle.RemoteFile(address, filename), 'bytes_read'), self.codec)
+        else:
+            self.recorder.count('bytes_read', os.path.getsize(filename))
+            run = compression.reader(open(filename, "rb"), self.codec)
+
+        for position, (key, value) in enumerate(self.serializer.load(run)):
+            yield (key, run_number, position, value)
+        run.close()
+
+        # Delete the run once it has been merged
+        if address is None and delete:
+            os.unlink(filename)
+
+
+    def merge_partition(self, file_index, reducer_num, partition, num_runs, combine=True):
+
+        """
+        Function to merge the spilled runs of a partition with its remaining in-memory records and write out the intermediate file
+        The intermediate file is sorted by key, so the reducer can merge the files of all the mappers as they are read
+        Invoked by mapper_controller() once the map task has finished
+
+        Inputs - 
+        file_index: number/identifier for the split being mapped
+        reducer_num: the reducer the partition is bound for
+        partition: list of key-value pairs still held in memory
+        num_runs: number of runs spilled for the partition
+        combine: Boolean flag to signify whether a key may occur more than once across the runs, and so is to be combined
+        """
+
+        # The in-memory records form the final run
+        runs = [self.read_run(fileNameRetriever.get_attempt_filename(fileNameRetriever.get_spill_file(file_index, reducer_num, run_number, output_dir=self.output_path, codec=self.codec)), run_number)
+                for run_number in range(num_runs)]
+        runs.append((key, num_runs, position, value) for position, (key, value) in enumerate(self.sort_partition(partition, combine)))
+
+        # Merge all the sorted runs into a single sorted stream of key-value pairs
+        records = ((key, value) for (key, run_number, position, value) in heapq.merge(*runs))
+
+        # Values of the same key may come from different runs, combine them again
+        # Keys the batch mapper has aggregated over the whole split occur in a single run only
+        if num_runs and combine and self.has_combiner():
+            records = self.combine_partition(records)
 
-            # Create a list containing the keys and values to be written out to temp file
-            out = [(key, value) for (key, value) in mapper_result if self.validate_pos(key, reducer_num)]
+        if self.collect_metrics:
+            records = self.recorder.counted(records, 'records_out')
 
-            # Populate the temp file with the list of keys and values grabbed from the mapper
-            json.dump(out, map_intermediate)
-            map_intermediate.close()
+        # Populate the temp file with the keys and values, without building the whole list in memory
+        self.commit_file(fileNameRetriever.get_intermediate_file(file_index, reducer_num, output_dir=self.output_path, codec=self.codec), records)
         
 
     def reducer_controller(self, index):
@@ -260,117 +1008,528 @@ class MapReduce(object):
         index: The index of the file being reduced
         """
 
-        print "Inside run_reducer, index:",index
+        print("Inside run_reducer, index:", index)
+        task_start = self.start_task('reduce', index)
+
+        # Every mapper wrote its partition sorted by key - read all of them as runs, one record at a time
+        # With a network shuffle, the files of all the mappers are fetched at once from the shuffle servers
+        # The intermediate files are kept around until the outputs are joined, in case the reducer is run again
+        runs = [self.read_run(fileNameRetriever.get_intermediate_file(i, index, output_dir=self.output_path, codec=self.codec), i, self.get_shuffle_address(i), delete=False)
+                for i in range(self.num_of_mappers)]
+
+        # Merge the runs into a single stream sorted by key and group the values of each key
+        # The reducer is handed the values as an iterator, so only the current key is ever held in memory
+        start = time.time()
+        merged = heapq.merge(*runs)
+        if self.collect_metrics:
+            merged = self.recorder.counted(merged, 'records_in')
+        kv_list = (self.reducer(key, (value for (group_key, run_number, position, value) in group))
+                   for key, group in groupby(merged, key=o(0)))
+        if self.collect_metrics:
+            kv_list = self.recorder.counted(kv_list, 'records_out')
+
+        # The results of the hot keys are partial, they are set aside for aggregate_hot_keys()
+        hot_keys = self.read_hot_keys()
+        hot_records = []
+        if hot_keys:
+            kv_list = self.set_aside(kv_list, hot_keys, hot_records)
+
+        # Populate the output file of the current reducer with the reducer outputs
+        # They are left in order of key and written as they are reduced, so the final join only has to merge the chunks
+        # The runs are read, merged, reduced and written out together
+        self.commit_file(fileNameRetriever.get_reduce_filename(index, output_dir=self.output_path, codec=self.codec), kv_list)
+        if hot_keys:
+            self.commit_file(fileNameRetriever.get_hot_reduce_filename(index, output_dir=self.output_path, codec=self.codec), hot_records)
+        self.recorder.record('reduce', start)
+
+        # The shuffle servers only delete the files fetched once the output is committed, a reducer that failed fetches them again
+        for i in range(self.num_of_mappers):
+            if not(self.get_shuffle_address(i) is None):
+                shuffle.acknowledge(self.get_shuffle_address(i), fileNameRetriever.get_intermediate_file(i, index, output_dir=self.output_path, codec=self.codec))
 
-        # Dictionary that will eventually contain all keys and values
-        kv_dict = {}
+        self.finish_task(task_start)
+
+
+    def check_shuffle(self):
+
+        """
+        Function to check that the job can run with a network shuffle, if it is given one
+        The hot keys split by every mapper and the partial results of every reducer are read off the shared output directory, which a network shuffle does without
+        Invoked by the constructor and by execute_mapreduce(), since the shuffle may be set up once the job is
+        """
+
+        if (self.shuffle_port is not None or self.shuffle_hosts) and self.hot_key_fanout > 1:
+            raise ValueError("Hot keys cannot be split across reducers with a network shuffle, set hot_key_fanout to 1")
+
+
+    def map_share(self, host_num, num_hosts):
+
+        """
+        Function to find the splits a map host is to map when the intermediate files are served over the network
+        The splits are spread round-robin across the map hosts, in the order of shuffle_hosts - get_shuffle_address() relies on it
+
+        Inputs - 
+        host_num: position of the map host among the map hosts, from 0
+        num_hosts: number of map hosts
 
-        # Iterate through the required number of mappers/splits
+        Output - 
+        List of the splits to map
+        """
+
+        return list(range(host_num, self.num_of_mappers, num_hosts))
+
+
+    def set_aside(self, records, keys, aside):
+
+        """
+        Generator to pass records through, except those of the given keys, which are appended to a list instead
+        Invoked by reducer_controller() to set the results of the hot keys aside
+
+        Inputs - 
+        records: iterable of key-value pairs
+        keys: set of the keys to set aside
+        aside: list the records set aside are appended to
+        """
+
+        for record in records:
+            if record[0] in keys:
+                aside.append(record)
+            else:
+                yield record
+
+
+    def get_shuffle_address(self, file_index):
+
+        """
+        Function to find the shuffle server holding the intermediate files of a mapper
+        The map tasks are spread round-robin across the hosts in shuffle_hosts, as handed out by map_share()
+
+        Input - 
+        file_index: number/identifier of the split that was mapped
+
+        Output - 
+        host:port of the shuffle server, or None if the intermediate files are read off the shared filesystem
+        """
+
+        if not self.shuffle_hosts:
+            return None
+
+        return self.shuffle_hosts[file_index % len(self.shuffle_hosts)]
+
+
+    def serve_shuffle(self, task_ids=None):
+
+        """
+        Function to serve the intermediate files written by the map tasks of the current node until the reducers have acknowledged all of them
+        The server gives up once no reducer has sent it anything for shuffle.IDLE_TIMEOUT seconds, so that a lost reducer never holds it up for good
+        Invoked by execute_mapreduce() after the map tasks are done, when a shuffle port is given
+
+        Input - 
+        task_ids: list of the splits mapped on this node, all of them if None
+        """
+
+        if task_ids is None:
+            task_ids = range(self.num_of_mappers)
+
+        # Count the intermediate files written on this node
+        num_files = len([(i, reducer_num) for i in task_ids for reducer_num in range(self.num_of_reducers)
+                         if os.path.exists(fileNameRetriever.get_intermediate_file(i, reducer_num, output_dir=self.output_path, codec=self.codec))])
+
+        if not num_files:
+            return
+
+        server = shuffle.ShuffleServer(self.shuffle_port, self.output_path, num_files)
+        server.serve_until_acknowledged()
+        server.server_close()
+
+
+    def read_hot_keys(self):
+
+        """
+        Function to read the keys that any of the mappers split across several reducers
+
+        Output - 
+        hot_keys: set of the hot keys
+        """
+
+        hot_keys = set()
         for i in range(self.num_of_mappers):
+            if os.path.exists(fileNameRetriever.get_hot_keys_file(i, output_dir=self.output_path, codec=self.codec)):
+                hot_keys_file = compression.reader(open(fileNameRetriever.get_hot_keys_file(i, output_dir=self.output_path, codec=self.codec), "rb"), self.codec)
+                hot_keys.update(self.serializer.load(hot_keys_file))
+                hot_keys_file.close()
 
-            # Read the contents of each intermediate map file onto a variable
-            map_intermediate = open(fileNameRetriever.get_intermediate_file(i, index), "r")
+        return hot_keys
 
-            # Convert the contents to JSON for ease of processsing
-            map = json.load(map_intermediate)
 
-            # Populate the dictionary
-            for (key, value) in map:
+    def aggregate_hot_keys(self, num_of_reducers):
 
-                # Check for key not existing and create an empty corresponding value
-                if not(key in kv_dict):
-                    kv_dict[key] = []
+        """
+        Function to reduce the partial results of the hot keys, once all the reducers are done
+        The final results are written out as one more chunk, which consolidate_chunks() merges in with the rest
+        Invoked by join_outputs()
 
-                # Populate the required value
-                try:
-                    kv_dict[key].append(value)
-                except Exception, e:
-                    print "cannot retrieve key"
+        Input - 
+        num_of_reducers: Number of reducers of the job
+        """
 
-            # Close intermediate file as it's not needed anymore, we have the populated dictionary
-            map_intermediate.close()
+        # Gather the partial results written by every reducer, there is only a handful of hot keys
+        kv_dict = {}
+        for index in range(num_of_reducers):
+            if os.path.exists(fileNameRetriever.get_hot_reduce_filename(index, output_dir=self.output_path, codec=self.codec)):
+                hot_file = compression.reader(open(fileNameRetriever.get_hot_reduce_filename(index, output_dir=self.output_path, codec=self.codec), "rb"), self.codec)
+                for (key, value) in self.serializer.load(hot_file):
+                    if not(key in kv_dict):
+                        kv_dict[key] = []
+                    kv_dict[key].append(value)
+                hot_file.close()
+                os.unlink(fileNameRetriever.get_hot_reduce_filename(index, output_dir=self.output_path, codec=self.codec))
 
-            # Delete the intermediate file
-            os.unlink(fileNameRetriever.get_intermediate_file(i, index))
-        
-        # Input the dictionary into the reducer and store the outputs onto a list
-        kv_list = []
-        for key in kv_dict:
-            kv_list.append(self.reducer(key, kv_dict[key]))
+        # The lists of hot keys are not needed anymore
+        for i in range(self.num_of_mappers):
+            if os.path.exists(fileNameRetriever.get_hot_keys_file(i, output_dir=self.output_path, codec=self.codec)):
+                os.unlink(fileNameRetriever.get_hot_keys_file(i, output_dir=self.output_path, codec=self.codec))
 
-        # Create an output file for the current reducer
-        output_file = open(fileNameRetriever.get_reduce_filename(index), "w+")
+        if not kv_dict:
+            return
 
-        # Populate output file with list and close the former
-        json.dump(kv_list, output_file)
+        # Reduce the partial results and write them out sorted by key, like any other chunk
+        kv_list = [self.reducer(key, iter(kv_dict[key])) for key in sorted(kv_dict)]
+        output_file = compression.writer(open(fileNameRetriever.get_reduce_filename(HOT_CHUNK, output_dir=self.output_path, codec=self.codec), "wb+"), self.codec)
+        self.serializer.dump(kv_list, output_file)
         output_file.close()
 
 
-    def mapper_mode(self):
+    def mapper_mode(self, task_ids=None):
 
         """
-        Function that invokes the mapper controller to create mappers for the required number of splits
+        Function that invokes the mapper controller to run a map task for every split
+        The splits are handed out to a fixed pool of num_of_workers processes, so there can be many more splits than workers
         Invoked in execute_mapper()
+
+        Input - 
+        task_ids: list of the splits to map, all of them if None. Used when the map tasks are spread across nodes
+
+        Output - 
+        Set of the splits mapped, by now or by an earlier run
         """
 
-        # initialize mappers list
-        mapper_list = []
+        if task_ids is None:
+            task_ids = list(range(self.num_of_mappers))
 
-        # Iterate for the given number of mappers
-        for tid in range(self.num_of_mappers):
+        start = time.time()
 
-            # Create a mapper process
-            p = Process(target=self.mapper_controller, args=(tid,))  
+        # Splits mapped by an earlier run of the job are skipped, as long as it partitioned them for as many reducers
+        self.manifest.repartition(self.num_of_reducers)
+        pending = self.pending_tasks('map', task_ids)
 
-            # This kicks off the mapper
-            p.start()
+        # Run the map tasks on the worker pool and wait for all of them to finish
+        completed = self.run_tasks(self.mapper_controller, pending)
+        self.manifest.mark_completed('map', completed)
 
-            # Store the process in the list, since the processes need to be joined later
-            mapper_list.append(p)
+        # The split files are not needed anymore once their map task has completed
+        if not self.virtual_splits:
+            for file_index in completed:
+                os.unlink(fileNameRetriever.get_split_filename(file_index))
 
-        # Call the in-built join() method on all the mapper processes
-        [t.join() for t in mapper_list]
+        self.recorder.record('map', start, 'phase')
+        self.write_job_metrics()
+        self.write_profile_reports('map')
+
+        return completed | (set(task_ids) - set(pending))
 
     
     def reducer_mode(self, join=False, thread_id=0):
 
         """
         Invoked in execute_mapreduce()
-        Function that invokes the reducer controller to create ONE reducer for one split
+        Function that invokes the reducer controller to create reducers for the splits assigned to the current system
         This is different to the mapper_mode() method, where all mappers are invoked from the mapper_mode()
-        In this case, we reduce only a single chunk. This is because we intend to invoke this method from various systems
-        Eah system/node can run multiple reducer processes, but they will be from different instantiations
+        In this case, we reduce only the chunks given. This is because we intend to invoke this method from various systems
+        All the chunks given are reduced concurrently, with at most num_of_workers reducer processes running at once
 
         Input - 
         join: Boolean flag to signify whether the outputs of the current and all previous reducers needs to be composited
-        thread_id: Executes the reducer for the given thread_id. Separate instances execute separate threads
+        thread_id: Executes the reducer for the given thread_id, or for every thread_id in the given list. Separate instances execute separate threads
         """
 
-        # initialize reducers list
-        # TODO - remove list usage
-        reducer_list = []
+        # A single thread ID is reduced on its own
+        if not(isinstance(thread_id, (list, tuple))):
+            thread_id = [thread_id]
 
-        print "Thread ID:",thread_id
+        print("Thread ID:", thread_id)
+        start = time.time()
 
-        # Create the reduce process
-        p = Process(target=self.reducer_controller, args=(thread_id,))
+        # Reductions completed by an earlier run of the job are skipped
+        pending = self.pending_tasks('reduce', thread_id)
 
-        # Kick off the reduction
-        p.start()
+        # Run the reductions concurrently and wait for all of them to finish
+        completed = self.run_tasks(self.reducer_controller, pending)
+        self.manifest.mark_completed('reduce', completed)
 
-        # Add reducer to reducer list
-        # TODO - Avoid this
-        reducer_list.append(p)
+        # The intermediate files are kept until the outputs are joined - a resumed job then only skips the map tasks whose files are all still there
 
-        # Join the reducer process to close it off
-        [t.join() for t in reducer_list]
+        self.recorder.record('reduce', start, 'phase')
+        self.write_job_metrics()
+        self.write_profile_reports('reduce')
 
         # Only invoke join_outputs() for the very final reduction, where the outputs of each reducer needs to be composited
         if join:
             self.join_outputs()
 
 
-    def execute_mapreduce(self, join=False, mode='mapreduce', tid=0):
+    def pending_tasks(self, phase, task_ids):
+
+        """
+        Function to find the tasks of a phase still to be run
+        A task recorded as completed in the manifest is only skipped if its output files are still on disk
+
+        Inputs - 
+        phase: 'map' or 'reduce'
+        task_ids: list of task IDs
+
+        Output - 
+        List of the task IDs still to be run
+        """
+
+        completed = self.manifest.completed(phase)
+
+        return [task_id for task_id in task_ids if not(task_id in completed and self.task_output_exists(phase, task_id))]
+
+
+    def task_output_exists(self, phase, task_id):
+
+        """
+        Function to check whether the output files of a task are all on disk
+
+        Inputs - 
+        phase: 'map' or 'reduce'
+        task_id: the task to check
+
+        Output - 
+        Boolean True/False signifying whether the outputs exist
+        """
+
+        if phase == 'map':
+            return all(os.path.exists(fileNameRetriever.get_intermediate_file(task_id, reducer_num, output_dir=self.output_path, codec=self.codec)) for reducer_num in range(self.num_of_reducers))
+
+        return os.path.exists(fileNameRetriever.get_reduce_filename(task_id, output_dir=self.output_path, codec=self.codec))
+
+
+    def run_tasks(self, target, task_ids):
+
+        """
+        Function to run the target once per task ID on a pool of at most num_of_workers processes
+        The task IDs are put on a queue, and every worker takes the next one as soon as it is done with its current one
+        A slow or oversized task then only holds up its own worker, the rest keep draining the queue
+        The tasks that failed are run again on their own, up to MAX_TASK_ATTEMPTS times in all
+        Invoked by mapper_mode() and reducer_mode()
+
+        Inputs - 
+        target: the function to run, it is passed the task ID
+        task_ids: list of task IDs to run the target for
+
+        Output - 
+        Set of the task IDs that completed
+        """
+
+        completed = set()
+        pending = list(task_ids)
+
+        for attempt in range(MAX_TASK_ATTEMPTS):
+
+            if not pending:
+                break
+
+            if attempt:
+                print("Running failed tasks again: " + ', '.join(str(task_id) for task_id in pending))
+
+            # Only start as many workers as there are tasks to run
+            num_processes = min(self.num_of_workers, len(pending))
+
+            # Queue up the tasks, followed by one stop marker per worker
+            tasks = WORKERS.Queue()
+            results = WORKERS.Queue()
+            for task_id in pending:
+                tasks.put(task_id)
+            for worker_num in range(num_processes):
+                tasks.put(None)
+
+            # Kick off the workers
+            workers = [WORKERS.Process(target=self.task_worker, args=(target, tasks, results)) for worker_num in range(num_processes)]
+            [p.start() for p in workers]
+
+            # Collect the tasks that completed until every worker has put its stop marker on the results queue
+            # The queue is drained before the workers are joined - a worker only exits once everything it put on the queue has been read
+            # A worker that died on the way never puts its stop marker, so the workers are checked on while waiting
+            num_running = num_processes
+            while num_running:
+                try:
+                    task_id = results.get(timeout=WORKER_POLL_INTERVAL)
+                except queue.Empty:
+                    if not([p for p in workers if p.is_alive()]):
+                        break
+                    continue
+
+                if task_id is None:
+                    num_running -= 1
+                else:
+                    completed.add(task_id)
+
+            [p.join() for p in workers]
+
+            # Whatever did not complete has failed
+            pending = [task_id for task_id in pending if not(task_id in completed)]
+
+        if pending:
+            print("Tasks failed after " + str(MAX_TASK_ATTEMPTS) + " attempts: " + ', '.join(str(task_id) for task_id in pending))
+
+        return completed
+
+
+    def task_worker(self, target, tasks, results):
+
+        """
+        Function run by every worker process of the pool, it keeps running tasks off the queue until it finds a stop marker
+        Invoked by run_tasks()
+
+        Inputs - 
+        target: the function to run, it is passed the task ID
+        tasks: queue holding the task IDs
+        results: queue the IDs of the completed tasks are put on, followed by a stop marker once the worker is done
+        """
+
+        for task_id in iter(tasks.get, None):
+
+            # A failing task must not take the rest of the worker's tasks down with it
+            try:
+                target(task_id)
+                results.put(task_id)
+            except Exception:
+                traceback.print_exc()
+
+        results.put(None)
+
+
+    def start_task(self, phase, task_id):
+
+        """
+        Function to start recording the metrics of a task, in place of those of the job
+        Invoked by mapper_controller() and reducer_controller(), on the worker running the task
+
+        Inputs -
+        phase: 'map' or 'reduce'
+        task_id: the task ID
+
+        Output -
+        The time the task started at
+        """
+
+        self.recorder = metrics.Recorder(phase, task_id)
+
+        # A task that failed leaves its profiler running, what it recorded is dropped
+        if not(self.profiler is None):
+            self.profiler.abandon()
+            self.profiler = None
+
+        if self.profile or self.trace_allocations:
+            self.profiler = profiling.TaskProfiler(self.profile, self.trace_allocations)
+            self.profiler.start()
+
+        return time.time()
+
+
+    def finish_task(self, start):
+
+        """
+        Function to record the span of the task that just completed and write its metrics out, if they are collected
+        The metrics file is named after the task, so a task run again only leaves the metrics of its last attempt
+
+        Input -
+        start: the time the task started at, as given by start_task()
+        """
+
+        recorder = self.recorder
+        recorder.record(recorder.phase + " " + str(recorder.task_id), start, 'task')
+        self.recorder = self.job_recorder
+
+        # Stop profiling first, so that writing the metrics is left out of the profile
+        if not(self.profiler is None):
+            traced_peak = self.profiler.stop(fileNameRetriever.get_profile_file(recorder.phase, recorder.task_id, self.output_path),
+                                             fileNameRetriever.get_allocations_file(recorder.phase, recorder.task_id, self.output_path))
+            self.profiler = None
+            if not(traced_peak is None):
+                recorder.count('traced_peak', traced_peak)
+
+        if self.collect_metrics:
+            recorder.write(fileNameRetriever.get_metrics_file(recorder.phase + "_" + str(recorder.task_id), self.output_path))
+
+
+    def write_job_metrics(self):
+
+        """
+        Function to write the metrics of the job recorded by the current process out, if they are collected
+        Every process has a file of its own, rewritten as every phase completes
+        """
+
+        if self.collect_metrics:
+            self.job_recorder.write(fileNameRetriever.get_metrics_file("job_" + self.job_recorder.host + "-" + str(self.job_recorder.pid), self.output_path))
+
+
+    def enable_options(self, options):
+
+        """
+        Function to turn on options of the job once it is set up, as given on the command line
+
+        Input -
+        options: list of names of options, out of JOB_OPTIONS
+        """
+
+        for option in options:
+            if not(option in JOB_OPTIONS):
+                raise ValueError("Unknown option: " + option)
+            if option == 'allocations' and profiling.tracemalloc is None:
+                raise ValueError("Tracing allocations requires tracemalloc, which only ships with Python 3")
+            setattr(self, JOB_OPTIONS[option], True)
+
+
+    def write_profile_reports(self, phase):
+
+        """
+        Function to merge the profiles of the tasks of a phase into its reports, if the tasks are profiled
+        Invoked as every phase completes - the reports then cover the tasks of the phase run so far, by any process
+
+        Input -
+        phase: 'map' or 'reduce'
+        """
+
+        if self.profile:
+            profiling.write_profile_report(phase, self.output_path)
+
+        if self.trace_allocations:
+            profiling.write_allocations_report(phase, self.output_path)
+
+
+    def measure(self, file, counter):
+
+        """
+        Function to count the bytes read from a remote file on the current recorder as they are received, if the metrics are collected
+
+        Inputs -
+        file: the open file
+        counter: name of the counter
+
+        Output -
+        The file to read from
+        """
+
+        if self.collect_metrics:
+            return metrics.CountingFile(file, self.recorder, counter)
+
+        return file
+
+
+    def execute_mapreduce(self, join=False, mode='mapreduce', tid=0, map_task_ids=None):
         
         """
         Master function to run the map and reduce operations - invokes mapper_mode() and reducer_mode()
@@ -378,44 +1537,90 @@ class MapReduce(object):
         Inputs - 
         join: Boolean flag to signify whether the outputs of the current and all previous reducers needs to be composited
         mode: String that will control whether the maps, reduce, or both are executed. In the current distributed implementation it is only supposed to be one of the two at once, i.e either 'map' or 'reduce'
-        tid: Thread ID for which the reduce is supposed to be run
+        tid: Thread ID, or list of thread IDs, for which the reduce is supposed to be run
+        map_task_ids: list of the splits to map, all of them if None - with a network shuffle, every map host maps its share as given by map_share()
         """
 
+        self.check_shuffle()
+
         # Check if maps are to be run
         if 'map' in mode:
-            self.mapper_mode()
+            mapped = self.mapper_mode(map_task_ids)
+
+            # In the distributed implementation, the mapper node can hand its intermediate files out over the network
+            if not('reduce' in mode) and self.shuffle_port is not None:
+                self.serve_shuffle(mapped)
 
         # Check if reduce is to be run 
         if 'reduce' in mode:
 
-            # In the case of the non-distributed implementation we run multiple reducers off the same program on a single system
+            # In the case of the non-distributed implementation we run all the reducers off the same program on a single system
             if self.num_of_reducers > 1:
-                for i in range(self.num_of_reducers):
-                    self.reducer_mode(thread_id=i)
+                self.reducer_mode(thread_id=list(range(self.num_of_reducers)))
 
-            # In the case of the distributed implementation we run only a single reducer for a single thread ID
+            # In the case of the distributed implementation we run only the reducers for the given thread IDs
             else:
                 self.reducer_mode(thread_id=tid)
 
 
-    def join_outputs(self, final_flag='n'):
+    def join_outputs(self, final_flag='n', top_k=None, full_output=True, num_of_reducers=None):
         
         """
         Function to composite all outputs into a single output file. This is to be invoked by the reducer_mode() method when the final reducer is being run
         
         Input - 
         final_flag: This signifies that the operation is a reduce and the reduce in question is the final reduce operation, thus the join should indeed go through
+        top_k: Number of records to return, all of them if None
+        full_output: Boolean flag to signify whether all the records, or only the top_k ones, are written to the output file
+        num_of_reducers: Number of reducer outputs to join, that of the job as recorded in the manifest if None
         """
 
-        # TODO - Possibly better to take in a new parameter for number of files to reduce
-        # Currently we decide that, if we need to reduce, the number of files to reduce is same as the number of files to map
-        # !!!!WARNING - HIGHLY DELICATE and NON-IDEAL!!!!
-        if final_flag == 'final':
-            self.num_of_reducers = self.num_of_mappers
+        # The final reduce may run on its own with a single reducer, the outputs of all the reducers of the job are joined
+        # The number of reducers the map outputs were partitioned for is recorded in the manifest
+        if num_of_reducers is None:
+            num_of_reducers = self.manifest.recorded_reducers() or self.num_of_reducers
 
-        # Run the consolidation
+        # Run the consolidation, the job is done once it has gone through
         try:
-            return self.fileOps.consolidate_chunks(self.num_of_reducers)
-        except Exception, e:
-            print "Could not perform current join"
-            return []
\ No newline at end of file
+            start = time.time()
+            self.aggregate_hot_keys(num_of_reducers)
+            self.recorder.record('aggregate_hot_keys', start)
+
+            consolidate_start = time.time()
+            joined = self.fileOps.consolidate_chunks(num_of_reducers, top_k=top_k, full_output=full_output)
+            self.recorder.record('consolidate', consolidate_start)
+            self.recorder.count('bytes_written', os.path.getsize(fileNameRetriever.get_output_filename(self.output_path)))
+            self.recorder.record('join', start, 'phase')
+
+            # Merge the metrics and profiles of every process of the job, now that none of them is left running
+            if self.collect_metrics:
+                self.write_job_metrics()
+                metrics.write_report(self.output_path)
+            for phase in ['map', 'reduce']:
+                self.write_profile_reports(phase)
+
+            self.clean_intermediates()
+            return joined
+        except Exception:
+            print("Could not perform current join")
+            return []
+
+
+    def clean_intermediates(self):
+
+        """
+        Function to delete what is left of the job once its outputs have been joined - the intermediate map files, the files of failed or losing attempts, the split table and the manifest
+        Invoked by join_outputs()
+        """
+
+        patterns = ['map_file_*.ext', 'map_file_*.ext.*', 'spill_file_*.ext.*', 'hot_keys_*.ext.*', 'hot_file_*.out.*', 'reduce_file_*.out.*', 'metrics_*.json', 'metrics_*.json.*',
+                    'profile_*_*.prof', 'profile_*_*.prof.*', 'allocations_*_*.snapshot', 'allocations_*_*.snapshot.*']
+        for pattern in patterns:
+            for leftover in glob.glob(os.path.join(self.output_path, pattern)):
+                os.unlink(leftover)
+
+        # The split table goes along with the manifest, the next run of the job splits its input again
+        if os.path.exists(fileNameRetriever.get_split_table_filename(self.output_path)):
+            os.unlink(fileNameRetriever.get_split_table_filename(self.output_path))
+
+        self.manifest.remove()
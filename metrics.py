@@ -0,0 +1,256 @@
+# Job metrics - wall time of every phase, task and step, bytes and records read and written, and peak memory of every worker
+# Every process records its own spans and writes them to a file of its own, the files are merged into a report and a Chrome trace once the job is joined
+import glob
+import json
+import os
+import resource
+import socket
+import sys
+import time
+
+import fileNameRetriever
+
+
+def peak_rss():
+
+    """
+    Function to read the peak resident memory of the current process
+
+    Output -
+    The peak resident memory, in MB
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux counts in KB, macOS in bytes
+    if sys.platform == 'darwin':
+        return peak / float(1 << 20)
+
+    return peak / float(1 << 10)
+
+
+# Wrapper counting the bytes read from or written to a file
+class CountingFile(object):
+
+    def __init__(self, file, recorder, counter):
+
+        """
+        Constructor to initialize the wrapper
+
+        Inputs -
+        file: the underlying file, or anything else with read(size) or write(data) methods
+        recorder: the Recorder to count the bytes on
+        counter: name of the counter, bytes_read or bytes_written
+        """
+
+        self.file = file
+        self.recorder = recorder
+        self.counter = counter
+
+    def read(self, size = -1):
+        data = self.file.read(size)
+        self.recorder.count(self.counter, len(data))
+        return data
+
+    def write(self, data):
+        self.recorder.count(self.counter, len(data))
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+# Recorder of the spans and counters of a process - either the job as a whole, or a single task run by a worker
+class Recorder(object):
+
+    def __init__(self, phase = 'job', task_id = None):
+
+        """
+        Constructor to initialize the recorder
+
+        Inputs -
+        phase: 'map' or 'reduce' for a task, 'job' for the process running the job as a whole
+        task_id: the task ID, None for the job
+        """
+
+        self.phase = phase
+        self.task_id = task_id
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.spans = []
+        self.counters = {}
+
+
+    def record(self, name, start, category = 'step'):
+
+        """
+        Function to record a span lasting from start until now
+
+        Inputs -
+        name: name of the span
+        start: the time the span started at, as given by time.time()
+        category: 'phase', 'task' or 'step'
+        """
+
+        self.spans.append({"name": name, "category": category, "start": start, "duration": time.time() - start})
+
+
+    def count(self, counter, amount = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+
+    def counted(self, records, counter):
+
+        """
+        Generator to pass records through, counting them
+
+        Inputs -
+        records: iterable of the records
+        counter: name of the counter, records_in or records_out
+        """
+
+        number = 0
+        for record in records:
+            number += 1
+            yield record
+
+        self.count(counter, number)
+
+
+    def write(self, filename):
+
+        """
+        Function to write the spans and counters out atomically, along with the peak memory of the process
+
+        Input -
+        filename: the file to write
+        """
+
+        contents = {"phase": self.phase, "task_id": self.task_id, "host": self.host, "pid": self.pid,
+                    "spans": self.spans, "counters": self.counters, "peak_rss": peak_rss()}
+
+        attempt_name = fileNameRetriever.get_attempt_filename(filename)
+        metrics_file = open(attempt_name, "w+")
+        json.dump(contents, metrics_file)
+        metrics_file.close()
+        os.rename(attempt_name, filename)
+
+
+def summarize(records):
+
+    """
+    Function to merge the records of all the processes into a report
+
+    Input -
+    records: list of the dictionaries written by Recorder.write()
+
+    Output -
+    Dictionary holding
+    - phases: start and duration of every phase, from the first process starting it to the last one ending it
+    - tasks: start, duration, time spent in every step, counters and worker of every task, in order of start
+    - totals: counters of every phase, summed over its tasks, and those the job processes counted themselves (the joined output) under 'job'
+    - workers: peak memory of every worker process, in MB
+    """
+
+    phases = {}
+    tasks = []
+    totals = {}
+    workers = {}
+
+    for record in records:
+        worker = record["host"] + ":" + str(record["pid"])
+        workers[worker] = max(workers.get(worker, 0), record["peak_rss"])
+
+        phase_totals = totals.setdefault(record["phase"], {})
+        for counter in record["counters"]:
+            phase_totals[counter] = phase_totals.get(counter, 0) + record["counters"][counter]
+
+        # Phases may be run by several processes, for example a reducer process per node
+        if record["phase"] == 'job':
+            for span in record["spans"]:
+                if span["category"] == 'phase':
+                    previous = phases.get(span["name"], span)
+                    start = min(span["start"], previous["start"])
+                    end = max(span["start"] + span["duration"], previous["start"] + previous["duration"])
+                    phases[span["name"]] = {"start": start, "duration": end - start}
+            continue
+
+        task = [span for span in record["spans"] if span["category"] == 'task'][0]
+        steps = {}
+        for span in record["spans"]:
+            if span["category"] == 'step':
+                steps[span["name"]] = steps.get(span["name"], 0) + span["duration"]
+
+        tasks.append({"phase": record["phase"], "task_id": record["task_id"], "worker": worker, "start": task["start"], "duration": task["duration"],
+                      "steps": steps, "counters": record["counters"], "peak_rss": record["peak_rss"]})
+
+    tasks.sort(key=lambda task: task["start"])
+
+    return {"phases": phases, "tasks": tasks, "totals": totals, "workers": workers}
+
+
+def trace_events(records):
+
+    """
+    Function to lay the spans of all the processes out as Chrome trace events (chrome://tracing, Perfetto)
+    Every host is a process of the trace and every process on it a thread, the steps of a task nest within it
+
+    Input -
+    records: list of the dictionaries written by Recorder.write()
+
+    Output -
+    Dictionary holding the trace events
+    """
+
+    starts = [span["start"] for record in records for span in record["spans"]]
+    origin = min(starts) if starts else 0
+    hosts = sorted(set(record["host"] for record in records))
+    events = []
+
+    for (host_number, host) in enumerate(hosts, 1):
+        events.append({"name": "process_name", "ph": "M", "pid": host_number, "args": {"name": host}})
+
+    named_threads = set()
+    for record in records:
+        host_number = hosts.index(record["host"]) + 1
+
+        if not((host_number, record["pid"]) in named_threads):
+            named_threads.add((host_number, record["pid"]))
+            thread_name = ("job " if record["phase"] == 'job' else "worker ") + str(record["pid"])
+            events.append({"name": "thread_name", "ph": "M", "pid": host_number, "tid": record["pid"], "args": {"name": thread_name}})
+
+        for span in record["spans"]:
+            args = {}
+            if span["category"] == 'task':
+                args = dict(record["counters"], peak_rss=record["peak_rss"])
+            events.append({"name": span["name"], "cat": span["category"], "ph": "X", "ts": (span["start"] - origin) * 1e6, "dur": span["duration"] * 1e6,
+                           "pid": host_number, "tid": record["pid"], "args": args})
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_report(output_dir = None):
+
+    """
+    Function to merge the metrics files written by all the processes of the job into the report and the trace, then delete them
+    Invoked by join_outputs() once the outputs of the job have been joined
+
+    Input -
+    output_dir: the output directory of the job
+    """
+
+    metrics_files = sorted(glob.glob(fileNameRetriever.get_metrics_file('*', output_dir)))
+    records = []
+    for filename in metrics_files:
+        metrics_file = open(filename, "r")
+        records.append(json.load(metrics_file))
+        metrics_file.close()
+
+    for (filename, contents) in [(fileNameRetriever.get_metrics_report_filename(output_dir), summarize(records)),
+                                 (fileNameRetriever.get_trace_filename(output_dir), trace_events(records))]:
+        report_file = open(filename, "w+")
+        json.dump(contents, report_file, indent=1, sort_keys=True)
+        report_file.close()
+
+    for filename in metrics_files:
+        os.unlink(filename)
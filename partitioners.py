@@ -0,0 +1,187 @@
+# Partitioners deciding which reducer every key emitted by the mappers is sent to
+from bisect import bisect_right
+from collections import Counter
+import zlib
+
+
+def key_bytes(key):
+
+    """
+    Function to turn a key into bytes that are the same on every interpreter and node
+
+    Input -
+    key: Key emitted by the mapper
+
+    Output -
+    The key as bytes - strings are encoded as UTF-8, any other key goes through its repr()
+    """
+
+    if isinstance(key, bytes):
+        return key
+
+    if hasattr(key, "encode"):
+        return key.encode("utf-8")
+
+    return repr(key).encode("utf-8")
+
+
+# Partitioner spreading the keys across the reducers with a CRC32 hash
+# Unlike the built-in hash(), CRC32 is the same across interpreters, runs and nodes
+class HashPartitioner(object):
+
+    name = "hash"
+
+    def __init__(self, num_of_reducers):
+        self.num_of_reducers = num_of_reducers
+
+    def partition(self, key):
+
+        """
+        Function to compute the reducer a key belongs to
+
+        Input -
+        key: Key emitted by the mapper
+
+        Output -
+        The index of the reducer the key is to be sent to
+        """
+
+        return (zlib.crc32(key_bytes(key)) & 0xffffffff) % self.num_of_reducers
+
+
+# Partitioner assigning contiguous ranges of keys to the reducers
+# The range boundaries are picked from a sample of the mapper output, so that every reducer receives about as many records
+# Reducer i only ever receives keys smaller than those of reducer i+1
+class RangePartitioner(object):
+
+    name = "range"
+
+    def __init__(self, num_of_reducers, boundaries):
+
+        """
+        Constructor to initialize the partitioner
+
+        Inputs -
+        num_of_reducers: Number of reducers to partition across
+        boundaries: Sorted list of num_of_reducers - 1 keys, reducer i receives the keys in [boundaries[i-1], boundaries[i])
+        """
+
+        self.num_of_reducers = num_of_reducers
+        self.boundaries = boundaries
+
+    def partition(self, key):
+
+        """
+        Function to compute the reducer a key belongs to
+
+        Input -
+        key: Key emitted by the mapper
+
+        Output -
+        The index of the reducer the key is to be sent to
+        """
+
+        return bisect_right(self.boundaries, key)
+
+    @classmethod
+    def from_sample(cls, num_of_reducers, sampled_keys):
+
+        """
+        Function to build a range partitioner out of a sample of the keys emitted by the mappers
+        Every occurrence of a key counts, so frequent keys weigh more when picking the boundaries
+
+        Inputs -
+        num_of_reducers: Number of reducers to partition across
+        sampled_keys: list of the keys emitted by the mapper over the sampled input
+
+        Output -
+        A RangePartitioner whose ranges hold about the same number of sampled records each
+        """
+
+        # Nothing was sampled - every key goes to the first reducer
+        if not sampled_keys:
+            return cls(num_of_reducers, [])
+
+        # Walk through the distinct keys in order, starting a new range once the current one holds its share of the sample
+        # A key more frequent than a whole share simply fills its range on its own
+        boundaries = []
+        seen = 0
+        for key, count in sorted(Counter(sampled_keys).items()):
+            if len(boundaries) < num_of_reducers - 1 and seen * num_of_reducers >= len(sampled_keys) * (len(boundaries) + 1):
+                boundaries.append(key)
+            seen += count
+
+        return cls(num_of_reducers, boundaries)
+
+
+# Misra-Gries sketch spotting the keys that make up a large share of the records seen by a mapper
+# Only a fixed number of counters is kept, so memory stays bounded whatever the number of distinct keys
+# A counter underestimates the count of its key by at most records_seen / (num_counters + 1)
+class HotKeySketch(object):
+
+    def __init__(self, num_counters, hot_share, warm_up):
+
+        """
+        Constructor to initialize the sketch
+
+        Inputs -
+        num_counters: Number of keys tracked at once
+        hot_share: Share of the records seen above which a key is considered hot, for example 0.1
+        warm_up: Number of records to see before any key is considered hot
+        """
+
+        self.num_counters = num_counters
+        self.hot_share = hot_share
+        self.warm_up = warm_up
+        self.counters = {}
+        self.records_seen = 0
+        self.hot_keys = set()
+
+    def add(self, key, weight = 1):
+
+        """
+        Function to count a record and check whether its key is hot
+
+        Inputs -
+        key: Key emitted by the mapper
+        weight: Number of records the record stands for, more than 1 if the mapper pre-aggregated them
+
+        Output -
+        Boolean True/False signifying whether the key is hot - once hot, a key stays hot
+        """
+
+        self.records_seen += weight
+
+        if key in self.hot_keys:
+            return True
+
+        # Count the key if it is tracked or there is a free counter
+        # Otherwise decrement every counter by as much as the weight, or until the smallest counter frees up - the rest of the weight then takes its place
+        if key in self.counters:
+            self.counters[key] += weight
+        elif len(self.counters) < self.num_counters:
+            self.counters[key] = weight
+        else:
+            decrement = min(weight, min(self.counters.values()))
+            for tracked_key in list(self.counters):
+                self.counters[tracked_key] -= decrement
+                if not self.counters[tracked_key]:
+                    del self.counters[tracked_key]
+
+            if decrement == weight:
+                return False
+            self.counters[key] = weight - decrement
+
+        # Check whether the key has grown past its share of the records
+        if self.records_seen >= self.warm_up and self.counters[key] > self.hot_share * self.records_seen:
+            self.hot_keys.add(key)
+            return True
+
+        return False
+
+
+# Partitioners available to a job, by name
+PARTITIONERS = {
+    HashPartitioner.name: HashPartitioner,
+    RangePartitioner.name: RangePartitioner,
+}
@@ -0,0 +1,146 @@
+# Task profiling - runs every map and reduce task under cProfile, and optionally tracemalloc, then merges the profiles of every phase into a report
+# Every task dumps its own profile, so that tasks run by any worker process, on any node, end up in the same report
+import cProfile
+import glob
+import os
+import pstats
+
+try:
+    import tracemalloc
+except ImportError:
+    # tracemalloc only ships with Python 3
+    tracemalloc = None
+
+import fileNameRetriever
+
+
+# Number of functions listed in every section of a profile report, and of lines in an allocations report
+REPORT_LINES = 40
+
+# Number of frames kept for every traced allocation
+TRACE_FRAMES = 1
+
+
+# Profiler of a single task, on the worker process running it
+class TaskProfiler(object):
+
+    def __init__(self, profile = True, trace_allocations = False):
+
+        """
+        Constructor to initialize the profiler
+
+        Inputs -
+        profile: Boolean flag to profile the time spent in every function with cProfile
+        trace_allocations: Boolean flag to trace the memory allocated by every line with tracemalloc
+        """
+
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_allocations = trace_allocations and not(tracemalloc is None)
+
+
+    def start(self):
+
+        if self.trace_allocations:
+            tracemalloc.start(TRACE_FRAMES)
+        if not(self.profiler is None):
+            self.profiler.enable()
+
+
+    def abandon(self):
+
+        # Stop profiling a task that failed, without dumping anything
+        if not(self.profiler is None):
+            self.profiler.disable()
+        if self.trace_allocations:
+            tracemalloc.stop()
+
+
+    def stop(self, profile_filename, allocations_filename):
+
+        """
+        Function to stop profiling and dump what was recorded
+        The allocations are those still held as the task finishes, which still include the records it built up
+
+        Inputs -
+        profile_filename: the file to dump the cProfile stats to
+        allocations_filename: the file to dump the tracemalloc snapshot to
+
+        Output -
+        The peak memory traced while the task ran in bytes, None if the allocations were not traced
+        """
+
+        if not(self.profiler is None):
+            self.profiler.disable()
+            self.profiler.dump_stats(fileNameRetriever.get_attempt_filename(profile_filename))
+            os.rename(fileNameRetriever.get_attempt_filename(profile_filename), profile_filename)
+
+        if not self.trace_allocations:
+            return None
+
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Leave out the allocations of tracemalloc and cProfile themselves
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__)])
+        snapshot.dump(fileNameRetriever.get_attempt_filename(allocations_filename))
+        os.rename(fileNameRetriever.get_attempt_filename(allocations_filename), allocations_filename)
+
+        return peak
+
+
+def write_profile_report(phase, output_dir = None):
+
+    """
+    Function to merge the cProfile stats of every task of a phase into a report, sorted by the time spent in every function itself and then including the functions it called
+    The merged stats are dumped along with it, so that they can be loaded into pstats or any profile viewer
+
+    Inputs -
+    phase: 'map' or 'reduce'
+    output_dir: the output directory of the job
+    """
+
+    profile_files = sorted(glob.glob(fileNameRetriever.get_profile_file(phase, '*', output_dir)))
+    if not profile_files:
+        return
+
+    report = open(fileNameRetriever.get_profile_report_filename(phase, output_dir), "w+")
+    report.write("Profile of the " + phase + " phase, merged over " + str(len(profile_files)) + " tasks\n\n")
+
+    stats = pstats.Stats(*profile_files, stream=report)
+    stats.strip_dirs()
+    for sort_key in ['tottime', 'cumulative']:
+        stats.sort_stats(sort_key).print_stats(REPORT_LINES)
+    report.close()
+
+    stats.dump_stats(fileNameRetriever.get_profile_file(phase, output_dir=output_dir))
+
+
+def write_allocations_report(phase, output_dir = None):
+
+    """
+    Function to merge the tracemalloc snapshots of every task of a phase into a report of the lines holding the most memory, summed over the tasks
+
+    Inputs -
+    phase: 'map' or 'reduce'
+    output_dir: the output directory of the job
+    """
+
+    snapshot_files = sorted(glob.glob(fileNameRetriever.get_allocations_file(phase, '*', output_dir)))
+    if tracemalloc is None or not snapshot_files:
+        return
+
+    # Sum the memory held by every line over the snapshots of all the tasks
+    sizes = {}
+    counts = {}
+    for snapshot_file in snapshot_files:
+        for statistic in tracemalloc.Snapshot.load(snapshot_file).statistics('lineno'):
+            sizes[statistic.traceback] = sizes.get(statistic.traceback, 0) + statistic.size
+            counts[statistic.traceback] = counts.get(statistic.traceback, 0) + statistic.count
+
+    report = open(fileNameRetriever.get_allocations_report_filename(phase, output_dir), "w+")
+    report.write("Memory held as the tasks of the " + phase + " phase finished, summed over " + str(len(snapshot_files)) + " tasks\n\n")
+    for traceback in sorted(sizes, key=sizes.get, reverse=True)[:REPORT_LINES]:
+        frame = traceback[0]
+        report.write("%10.1f KiB %10d blocks  %s:%d\n" % (sizes[traceback] / 1024.0, counts[traceback], frame.filename, frame.lineno))
+    report.close()
@@ -0,0 +1,148 @@
+# Serializers for the intermediate files written between the map, reduce and join phases
+import json
+import marshal
+import struct
+from itertools import islice
+
+
+# Length prefix written before every marshalled record - a little-endian unsigned 32 bit integer
+LENGTH_PREFIX = struct.Struct("<I")
+
+# Number of records encoded at once by the JSON serializer
+JSON_BATCH_SIZE = 1024
+
+
+# Serializer writing every record as a length-prefixed marshal blob
+# Records can be read back one at a time, without loading the whole file
+# marshal output is only guaranteed to be readable by the same Python version, which holds for the intermediate files of a single job
+class MarshalSerializer(object):
+
+    name = "marshal"
+
+    def dump(self, records, file):
+
+        """
+        Function to write records out to a file opened in binary mode
+
+        Inputs -
+        records: iterable of records, for example key-value pairs
+        file: the open file to write to
+        """
+
+        for record in records:
+            data = marshal.dumps(record)
+            file.write(LENGTH_PREFIX.pack(len(data)))
+            file.write(data)
+
+
+    def load(self, file):
+
+        """
+        Generator to read records back from a file opened in binary mode
+
+        Input -
+        file: the open file to read from
+
+        Output -
+        Generator of records in the order they were written
+        """
+
+        while True:
+
+            # Read the length of the next record - an empty read means the file is done
+            prefix = file.read(LENGTH_PREFIX.size)
+            if not prefix:
+                return
+
+            (length,) = LENGTH_PREFIX.unpack(prefix)
+            yield marshal.loads(file.read(length))
+
+
+def bytes_to_text(obj):
+
+    """
+    Function to write out bytes, which JSON has no type for, as text
+    Invoked by json.dumps() for any object it cannot serialize
+
+    Input -
+    obj: the object to serialize
+
+    Output -
+    The bytes decoded as UTF-8
+    """
+
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+# Serializer writing all records as a single JSON list, kept around for debugging since the files are human readable
+# Tuples come back as lists, and bytes as text
+class JSONSerializer(object):
+
+    name = "json"
+
+    def dump(self, records, file):
+
+        """
+        Function to write records out to a file opened in binary mode, JSON_BATCH_SIZE records at a time
+        Only the current batch is held in memory, and the encoder is set up once rather than for every record
+
+        Inputs -
+        records: iterable of records, for example key-value pairs
+        file: the open file to write to
+        """
+
+        encoder = json.JSONEncoder(default=bytes_to_text)
+        records = iter(records)
+
+        # Every batch is encoded as a list, whose brackets are left out
+        file.write(b"[")
+        for (batch_number, batch) in enumerate(iter(lambda: list(islice(records, JSON_BATCH_SIZE)), [])):
+            if batch_number:
+                file.write(b", ")
+            file.write(encoder.encode(batch)[1:-1].encode("utf-8"))
+        file.write(b"]")
+
+
+    def load(self, file):
+
+        """
+        Generator to read records back from a file opened in binary mode
+        The JSON list is parsed as a whole before the first record is returned
+
+        Input -
+        file: the open file to read from
+
+        Output -
+        Generator of records in the order they were written
+        """
+
+        for record in json.loads(file.read().decode("utf-8")):
+            yield record
+
+
+# Serializers available to a job, by name
+SERIALIZERS = {
+    MarshalSerializer.name: MarshalSerializer,
+    JSONSerializer.name: JSONSerializer,
+}
+
+
+def get_serializer(name = "marshal"):
+
+    """
+    Function to retrieve a serializer given its name
+
+    Input -
+    name: one of the names in SERIALIZERS
+
+    Output -
+    An instance of the requested serializer
+    """
+
+    if not(name in SERIALIZERS):
+        raise ValueError("Unknown serializer: " + str(name))
+
+    return SERIALIZERS[name]()
@@ -0,0 +1,321 @@
+# Shuffle service - serves the intermediate map files over TCP, so reducers on other nodes need no shared filesystem
+import os
+import socket
+import struct
+import threading
+import time
+
+try:
+    import socketserver
+    import queue
+except ImportError:
+    import SocketServer as socketserver
+    import Queue as queue
+
+
+# Length sent ahead of every file - a big-endian signed 64 bit integer, -1 if the file does not exist
+LENGTH_HEADER = struct.Struct(">q")
+
+# Number of bytes sent or received at a time
+BLOCK_SIZE = 1 << 16
+
+# Number of blocks a fetcher may read ahead of the reducer
+READ_AHEAD = 64
+
+# Number of attempts, one second apart, made to connect to a shuffle server that is not up yet
+CONNECT_ATTEMPTS = 30
+
+# Number of seconds a shuffle server waits for a request, with none in progress, before it gives up on the reducers left
+IDLE_TIMEOUT = 600
+
+# Prefix of the request a reducer sends for each of its files once it has committed its output
+ACK_REQUEST = "ack "
+
+
+# Handler for a single request - either a fetch, whose request is the name of a file in the output directory and whose response is its length and contents,
+# or an acknowledgement that a file is no longer needed, whose response is a length of 0
+class ShuffleHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        request = self.rfile.readline().strip().decode("utf-8")
+        acknowledged = request.startswith(ACK_REQUEST)
+        if acknowledged:
+            request = request[len(ACK_REQUEST):]
+
+        # Only plain file names are served, nothing outside the output directory
+        filename = os.path.basename(request)
+        path = os.path.join(self.server.output_dir, filename)
+
+        # The reducer has committed its output, the file can go - a backup attempt of the same reducer may have deleted it already
+        if acknowledged:
+            try:
+                os.unlink(path)
+                self.server.file_acknowledged()
+            except OSError:
+                pass
+            self.wfile.write(LENGTH_HEADER.pack(0))
+            return
+
+        if not(os.path.exists(path)):
+            self.wfile.write(LENGTH_HEADER.pack(-1))
+            return
+
+        # Stream the file out one block at a time
+        self.wfile.write(LENGTH_HEADER.pack(os.path.getsize(path)))
+        f = open(path, "rb")
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            self.wfile.write(block)
+        f.close()
+        self.wfile.flush()
+
+        # The file is kept until the reducer acknowledges it, a reducer that fails is run again off the same file
+
+
+# Server handing out the intermediate map files of the current node, one thread per fetch
+class ShuffleServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port, output_dir = "output", num_files = None, idle_timeout = IDLE_TIMEOUT):
+
+        """
+        Constructor to bind the server
+
+        Inputs -
+        port: Port to listen on, on all interfaces
+        output_dir: Directory holding the intermediate map files
+        num_files: Number of files to be acknowledged before the server stops, it keeps serving forever if None
+        idle_timeout: Number of seconds without any request after which serve_until_acknowledged() stops the server
+        """
+
+        socketserver.TCPServer.__init__(self, ("", port), ShuffleHandler)
+        self.output_dir = output_dir
+        self.num_files = num_files
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_active = time.time()
+        self.stopped = False
+
+
+    def process_request_thread(self, request, client_address):
+
+        # Keep track of the requests in progress, the server is only idle once none is left
+        with self.lock:
+            self.active += 1
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.last_active = time.time()
+
+
+    def serve_until_acknowledged(self):
+
+        """
+        Function to serve until every file has been acknowledged, or until the server has been idle for idle_timeout seconds
+        A reducer that failed, or was never started, would otherwise hold the server up for good
+        """
+
+        watchdog = threading.Thread(target=self.watch)
+        watchdog.daemon = True
+        watchdog.start()
+
+        self.serve_forever()
+        self.stopped = True
+
+
+    def watch(self):
+
+        # Run by the watchdog thread - stop the server once it has gone idle
+        while not self.stopped:
+            time.sleep(min(1, self.idle_timeout))
+            with self.lock:
+                idle = not self.active and time.time() - self.last_active > self.idle_timeout
+            if idle and not self.stopped:
+                print("Shuffle server idle for " + str(self.idle_timeout) + " seconds, " + str(self.num_files) + " files were never acknowledged")
+                self.shutdown()
+                return
+
+
+    def file_acknowledged(self):
+
+        """
+        Function to count an acknowledged file and stop the server once every file has been acknowledged
+        Invoked by ShuffleHandler
+        """
+
+        with self.lock:
+            if self.num_files is None:
+                return
+            self.num_files -= 1
+            done = self.num_files <= 0
+
+        # shutdown() waits for serve_forever() to return, so it has to be called off the serving thread
+        if done:
+            threading.Thread(target=self.shutdown).start()
+
+
+def parse_address(address):
+
+    """
+    Function to split a host:port string
+
+    Input -
+    address: String of the form host:port
+
+    Output -
+    (host, port) tuple
+    """
+
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def connect(address):
+
+    """
+    Function to connect to a shuffle server, waiting for it to come up if needed
+
+    Input -
+    address: host:port of the server
+
+    Output -
+    The connected socket
+    """
+
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            return socket.create_connection(parse_address(address))
+        except socket.error:
+            if attempt == CONNECT_ATTEMPTS - 1:
+                raise
+            time.sleep(1)
+
+
+def acknowledge(address, filename):
+
+    """
+    Function to let a shuffle server know a file is no longer needed, once the reducer reading it has committed its output
+    The server only deletes the file then, so that a reducer that fails after fetching it can fetch it again
+
+    Inputs -
+    address: host:port of the shuffle server holding the file
+    filename: Name of the file in the output directory of the server
+    """
+
+    sock = connect(address)
+    sock.sendall((ACK_REQUEST + os.path.basename(filename) + "\n").encode("utf-8"))
+    sock_file = sock.makefile("rb")
+    sock_file.read(LENGTH_HEADER.size)
+    sock_file.close()
+    sock.close()
+
+
+# File-like reader over a file being fetched in the background
+# A fetcher thread reads the socket into a bounded queue while the reducer deserializes what has already arrived
+class RemoteFile(object):
+
+    def __init__(self, address, filename):
+
+        """
+        Constructor to request the file and start fetching it
+
+        Inputs -
+        address: host:port of the shuffle server holding the file
+        filename: Name of the file in the output directory of the server
+        """
+
+        self.sock = connect(address)
+        self.sock.sendall((os.path.basename(filename) + "\n").encode("utf-8"))
+        self.blocks = queue.Queue(READ_AHEAD)
+        self.buffer = b""
+        self.position = 0
+        self.error = None
+
+        # Fetch in the background, the reducer is only held up if the fetch falls behind
+        self.fetcher = threading.Thread(target=self.fetch, args=(filename,))
+        self.fetcher.daemon = True
+        self.fetcher.start()
+
+
+    def fetch(self, filename):
+
+        """
+        Function run by the fetcher thread, it reads the whole response into the queue of blocks
+        An empty block marks the end of the file
+        """
+
+        try:
+            sock_file = self.sock.makefile("rb")
+            header = sock_file.read(LENGTH_HEADER.size)
+            if len(header) < LENGTH_HEADER.size:
+                raise IOError("Shuffle server closed the connection for " + filename)
+
+            (remaining,) = LENGTH_HEADER.unpack(header)
+            if remaining < 0:
+                raise IOError("Shuffle server does not have " + filename)
+
+            while remaining > 0:
+                block = sock_file.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    raise IOError("Shuffle server closed the connection for " + filename)
+                self.blocks.put(block)
+                remaining -= len(block)
+
+            sock_file.close()
+
+        except Exception as e:
+            self.error = e
+
+        self.sock.close()
+        self.blocks.put(b"")
+
+
+    def read(self, size = -1):
+
+        """
+        Function to read up to size bytes, or everything left if size is negative
+
+        Input -
+        size: Number of bytes to read
+
+        Output -
+        The bytes read, fewer than size only at the end of the file
+        """
+
+        pieces = []
+        needed = size
+        while size < 0 or needed > 0:
+
+            # Move on to the next block once the current one has been used up
+            if self.position >= len(self.buffer):
+                block = self.blocks.get()
+                if not block:
+                    self.blocks.put(block)
+                    break
+                self.buffer, self.position = block, 0
+
+            if size < 0:
+                end = len(self.buffer)
+            else:
+                end = min(len(self.buffer), self.position + needed)
+                needed -= end - self.position
+
+            pieces.append(self.buffer[self.position:end])
+            self.position = end
+
+        # A failed fetch must not pass for a shorter file
+        if self.error is not None:
+            raise self.error
+
+        return b"".join(pieces)
+
+
+    def close(self):
+
+        # The socket is closed by the fetcher thread once the whole file has been received
+        pass
@@ -1,7 +1,12 @@
+from __future__ import print_function
 import sys
+from collections import Counter
 from mapreduce import MapReduce
 
-print "Python Major Version",sys.version_info[0],"Minor Version",sys.version_info[1]
+print("Python Major Version", sys.version_info[0], "Minor Version", sys.version_info[1])
+
+# Characters a valid word is made of - those between 'A' and DEL, as checked by is_word()
+WORD_CHARACTERS = bytes(bytearray(range(65, 128)))
 
 # The WordCount class inherits off the MapReduce class and implements/overrides the mapper and reducer functions
 class WordCount(MapReduce):
@@ -17,10 +22,10 @@ class WordCount(MapReduce):
         Function that implements the mapper and overrides the corresponding MapReduce class method 
 
         Input - 
-        key, value: Value stores the line, the keys are words and the values then become the count
+        key, value: Value stores the chunk as bytes, the keys are words and the values then become the count
 
         Output - 
-        results: list containing key-value pairs where the key is word and value is count
+        results: list containing key-value pairs where the key is word (as bytes) and value is count
         """
 
         # Initialize list to store intermediate mapper output
@@ -40,6 +45,41 @@ class WordCount(MapReduce):
 
         return results
 
+    # Implement the batch mapper - it is run instead of the mapper above and gives the same counts
+    def batch_mapper(self, key, value):
+
+        """
+        Function that counts the words of a whole chunk at once and overrides the corresponding MapReduce class method
+        The chunk is split and counted by Counter, so the per-character check only runs once per distinct word instead of once per word
+
+        Input - 
+        key, value: Value stores the chunk as bytes, the keys are words and the values then become the count
+
+        Output - 
+        counts: dictionary holding the count of every valid word (as bytes) in the chunk
+        """
+
+        # Lowercase the whole chunk at once - this only changes 'A' to 'Z', so a word stays valid or invalid either way
+        words = Counter(value.lower().split())
+
+        # Keep only the valid words - deleting the valid characters from a valid word leaves nothing behind
+        return dict((word, count) for (word, count) in words.items() if not word.translate(None, WORD_CHARACTERS))
+
+    def record_weight(self, key, value):
+
+        """
+        Function that weighs every key-value pair by its count and overrides the corresponding MapReduce class method
+        The batch mapper emits every word once per chunk, along with its count, so the hot words are found by their counts
+
+        Input - 
+        key, value
+
+        Output - 
+        The count of the word
+        """
+
+        return value
+
     def is_word(self, word):
         
         """
@@ -49,7 +89,7 @@ class WordCount(MapReduce):
         word: word given by the mapper() method
         """
 
-        return all(64 < ord(character) < 128 for character in word)
+        return all(64 < character < 128 for character in bytearray(word))
 
     def reducer(self, key, values):
 
@@ -66,13 +106,27 @@ class WordCount(MapReduce):
         wordcount = sum(value for value in values)
         return key, wordcount
 
+    def combiner(self, key, values):
+
+        """
+        Function that implements the combiner and overrides the corresponding MapReduce class method
+        Counts are summed up on the mapper side already, the reducer then adds up the partial counts
+
+        Input - 
+        key, values
+
+        Outputs - 
+        key, wordcount - the partial count of the key within a single mapper partition
+        """
+
+        return self.reducer(key, values)
+
 
 if __name__ == '__main__':
 
     # Example argument list - 4 4 mapreduce final
 
-    # Hard-coding input and output directories
-    input_dir = 'input'
+    # Hard-coding the output directory
     output_dir = 'output'
 
     # Accept number of mappers and reducers for task from user
@@ -90,31 +144,54 @@ if __name__ == '__main__':
     final_flag = sys.argv[4]
 
     # The ID of the thread that is used to decide the chunk the reducer should work on
-    # Only used when mode is either 'reduce' or 'mapreduce'
+    # Several comma-separated IDs (for example 0,1) are reduced concurrently on the same node
+    # In 'map' mode, <k>/<n> maps the share of the k-th of n map hosts serving a network shuffle, every n-th split from the k-th - any other ID maps all the splits
     # This is given by the controller script
-    tid = sys.argv[5]
+    map_host = sys.argv[5].split('/') if mode == 'map' and '/' in sys.argv[5] else None
+    tid = [int(thread) for thread in sys.argv[5].split(',')] if map_host is None else [0]
+
+    # Optional network shuffle, given by the controller script
+    # In 'map' mode this is the port to serve the intermediate files on, in 'reduce' mode the comma-separated host:port list of the shuffle servers
+    # '-' leaves the shuffle out, so that an input can follow
+    shuffle = sys.argv[6] if len(sys.argv) > 6 and sys.argv[6] != '-' else None
+
+    # Optional input - a file, a directory of files or a glob pattern, read in place
+    # Defaults to the input directory, holding the primary input file
+    input_dir = sys.argv[7] if len(sys.argv) > 7 else 'input'
+
+    # Optional comma-separated options - 'metrics' writes out the metrics of the job and its timeline once the outputs are joined,
+    # 'profile' and 'allocations' profile every task with cProfile and tracemalloc into a report per phase
+    options = [option for option in sys.argv[8].split(',') if option != '-'] if len(sys.argv) > 8 else []
 
     # Instantiate WordCount class with the user inputs
     word_count = WordCount(input_dir, output_dir, n_mappers, n_reducers)
+    word_count.enable_options(options)
+
+    if shuffle is not None and mode == 'map':
+        word_count.shuffle_port = int(shuffle)
+    elif shuffle is not None:
+        word_count.shuffle_hosts = shuffle.split(',')
 
     # Run the map/reduce (or both) operations with the script inputs
-    word_count.execute_mapreduce(mode=mode, tid=tid)
+    map_task_ids = word_count.map_share(int(map_host[0]), int(map_host[1])) if map_host is not None else None
+    word_count.execute_mapreduce(mode=mode, tid=tid, map_task_ids=map_task_ids)
 
     # Only consolidate results if the operation in question is the final reduce operation
     if final_flag == 'final':
 
-        # Instantiate variable to read the joined outputs
-        reducer_result = (word for word in word_count.join_outputs(final_flag=final_flag))
+        # Instantiate variable to read the joined outputs - all of them are written out, only the top 25 are kept in memory
+        reducer_result = (word for word in word_count.join_outputs(final_flag=final_flag, top_k=25))
 
-        print "\n\nPrinting top 25 most frequent words and their frequencies:"
+        print("\n\nPrinting top 25 most frequent words and their frequencies:")
         for i in range(25):
 
             try:
-                word, count = reducer_result.next()
-                print word, count
+                # The words are only decoded for printing
+                word, count = next(reducer_result)
+                print(word.decode("ascii"), count)
 
             except Exception:
                 pass
 
     else:
-        print "Non-final Map/Reduce Completed"
+        print("Non-final Map/Reduce Completed")